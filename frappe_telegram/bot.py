@@ -1,18 +1,54 @@
+import re
+import hmac
 from typing import Union
 from telegram.ext import Updater
 
 
 import frappe
+from frappe.utils.password import get_decrypted_password
 from frappe_telegram.frappe_telegram.doctype import TelegramBot
 from telegram.ext.dispatcher import Dispatcher
 from telegram.ext.messagehandler import MessageHandler
+from frappe_telegram.utils.cache import TTLCache
+from frappe_telegram.utils.polling import (
+    DurablePoller, UpdateOffsetKeeper, stop_pollers, DRAIN_TIMEOUT)
+from frappe_telegram.utils.routing import get_handled_update_types
+from frappe_telegram.utils.webhook import start_webhook_ingress, parse_update, WEBHOOK_QUEUE_SIZE
 
 
-def start_polling(site: str, telegram_bot: Union[str, TelegramBot], poll_interval: int = 0):
-    updater = get_bot(telegram_bot=telegram_bot, site=site)
+# Types of Update the handlers of each bot can match, by bot
+HANDLED_UPDATE_TYPES_KEY = "telegram_bot_handled_update_types"
 
-    updater.start_polling(poll_interval=poll_interval)
-    updater.idle()
+
+def start_polling(
+        site: str,
+        telegram_bot: Union[str, TelegramBot],
+        poll_interval: int = 0,
+        persistent_connections: bool = False,
+        update_workers: int = 0,
+        processes: int = 0,
+        buffered_logging: bool = False,
+        drain_timeout: float = DRAIN_TIMEOUT):
+    """
+    Polls from the update offset saved on the Telegram Bot. On shutdown, the Updates in flight get
+    drain_timeout seconds to complete; see frappe_telegram.utils.polling
+    """
+    updater = get_updater(
+        telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+        update_workers=update_workers, processes=processes, buffered_logging=buffered_logging)
+
+    if processes:
+        # Updates are processed in the worker processes, out of reach of the offset tracking
+        updater.dispatcher.start_pool()
+        updater.start_polling(
+            poll_interval=poll_interval, allowed_updates=updater.dispatcher.allowed_updates)
+        updater.idle()
+        return
+
+    poller = DurablePoller(
+        updater, site=site, poll_interval=poll_interval, drain_timeout=drain_timeout)
+    poller.start()
+    poller.idle()
 
 
 def start_webhook(
@@ -20,16 +56,266 @@ def start_webhook(
         telegram_bot: Union[str, TelegramBot],
         listen_host: str = "127.0.0.1",
         webhook_port: int = 80,
-        webhook_url: str = None):
-    updater = get_bot(telegram_bot=telegram_bot, site=site)
-    updater.start_webhook(
+        webhook_url: str = None,
+        persistent_connections: bool = False,
+        update_workers: int = 0,
+        processes: int = 0,
+        buffered_logging: bool = False,
+        webhook_queue_size: int = WEBHOOK_QUEUE_SIZE,
+        webhook_overflow: str = "reject"):
+    """
+    Receives Updates on a WebhookIngress, which answers Telegram as soon as an Update is queued.
+    webhook_queue_size bounds the queue, and webhook_overflow decides what happens to Updates
+    arriving while it is full; see frappe_telegram.utils.webhook
+    """
+    updater = get_updater(
+        telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+        update_workers=update_workers, processes=processes, buffered_logging=buffered_logging,
+        update_queue_size=webhook_queue_size)
+    if processes:
+        # The types of Update to receive are known once the workers have set up their handlers
+        updater.dispatcher.start_pool()
+    start_webhook_ingress(
+        updater,
         listen=listen_host,
         port=webhook_port,
-        webhook_url=webhook_url
+        webhook_url=webhook_url,
+        overflow=webhook_overflow,
+        allowed_updates=updater.dispatcher.allowed_updates,
     )
+    updater.idle()
+
+
+def start_bots(
+        site: str,
+        telegram_bots: list = None,
+        poll_interval: int = 0,
+        persistent_connections: bool = False,
+        update_workers: int = 4,
+        buffered_logging: bool = False,
+        drain_timeout: float = DRAIN_TIMEOUT):
+    """
+    Polls many Telegram Bots from this one process; all of them if none are specified.
+    Each bot keeps its own Updater, Dispatcher & hooked handlers. They share a single pool of
+    update_workers threads (and so, with persistent_connections, of db connections) and a single
+    pool of connections to Telegram. Each bot is polled by a DurablePoller, and their offsets
+    are saved from a single thread
+    """
+    import signal
+    import threading
+    from telegram.utils.request import Request
+    from .utils.scheduler import ChatShardScheduler
+    from .utils.connection import release_site_connection
+    from .utils.message_buffer import start_message_buffer, stop_message_buffer
+    from .utils.chat_activity import start_last_message_coalescer, stop_last_message_coalescer
+
+    if not telegram_bots:
+        with frappe.init_site(site):
+            frappe.connect()
+            telegram_bots = frappe.get_all("Telegram Bot", pluck="name")
+
+    if not telegram_bots:
+        print("No Telegram Bots to start")
+        return
+
+    scheduler = ChatShardScheduler(
+        None, workers=max(update_workers, 1), name="telegram-bots",
+        on_worker_exit=release_site_connection if persistent_connections else None)
+    # A long poll holds a connection per bot
+    request = Request(con_pool_size=len(telegram_bots) + scheduler.workers + 4)
+
+    updaters = [
+        get_bot(
+            telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+            buffered_logging=buffered_logging, scheduler=scheduler, request=request)
+        for telegram_bot in telegram_bots
+    ]
+
+    # Held for as long as the shared pool runs, which outlives the dispatchers
+    start_last_message_coalescer(site)
+    if buffered_logging:
+        start_message_buffer(site)
+    scheduler.start()
+
+    offset_keeper = UpdateOffsetKeeper(site, name="telegram-bots")
+    pollers = [
+        DurablePoller(
+            updater, site=site, poll_interval=poll_interval, drain_timeout=drain_timeout,
+            offset_keeper=offset_keeper)
+        for updater in updaters
+    ]
+    for poller in pollers:
+        poller.start()
+    offset_keeper.start()
+    print("Started {} Telegram Bots: {}".format(len(updaters), ", ".join(telegram_bots)))
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+    while not stop_event.wait(1):
+        pass
 
+    def stop_services():
+        if buffered_logging:
+            stop_message_buffer()
+        stop_last_message_coalescer()
 
-def get_bot(telegram_bot: Union[str, TelegramBot], site=None) -> Updater:
+    # Every bot stops fetching at once, and their dispatchers wind down together
+    stop_pollers(pollers, drain_timeout=drain_timeout, stop_services=stop_services)
+    scheduler.stop()
+    stop_services()
+
+
+# RQ queue that Updates received on the site are processed on, when configured under workers
+WEBHOOK_RQ_QUEUE = "telegram"
+
+# Updaters built by RQ workers, per (site, Telegram Bot)
+_webhook_updaters = dict()
+
+# Webhook secret tokens, per (site, Telegram Bot); saves decrypting them on every request.
+# Cached along with a version kept in redis, which every change to a Telegram Bot bumps
+webhook_secret_cache = TTLCache(maxsize=256, ttl=60)
+
+WEBHOOK_SECRET_VERSION_KEY = "telegram_webhook_secret_version"
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def receive_webhook_update(telegram_bot: str):
+    """
+    Webhook endpoint for Telegram Bots receiving Updates on the site itself, in place of a
+    start-bot process. Telegram is answered as soon as the raw Update is enqueued; it is processed
+    by an RQ worker
+    """
+    secret_token = get_webhook_secret_token(telegram_bot)
+    received_token = frappe.get_request_header("X-Telegram-Bot-Api-Secret-Token") or ""
+    if not secret_token or not hmac.compare_digest(secret_token, received_token):
+        raise frappe.PermissionError
+
+    frappe.enqueue(
+        "frappe_telegram.bot.process_webhook_update",
+        queue=get_webhook_rq_queue(),
+        telegram_bot=telegram_bot,
+        update=frappe.request.get_data(as_text=True))
+
+
+def process_webhook_update(telegram_bot: str, update: str):
+    """
+    RQ job processing an Update received on the site, through the same handlers as start-bot
+    """
+    updater = get_webhook_updater(telegram_bot)
+    update = parse_update(update, updater.bot)
+    if update:
+        updater.dispatcher.process_update_in_current_context(update)
+
+
+def get_webhook_updater(telegram_bot: str) -> Updater:
+    """
+    Returns the Updater of the Telegram Bot, built once per RQ worker & rebuilt when the
+    Telegram Bot is modified
+    """
+    key = (frappe.local.site, telegram_bot)
+    modified = frappe.get_cached_value("Telegram Bot", telegram_bot, "modified")
+    entry = _webhook_updaters.get(key)
+    if entry and entry[0] == modified:
+        return entry[1]
+
+    updater = get_bot(telegram_bot=telegram_bot, site=frappe.local.site)
+    _webhook_updaters[key] = (modified, updater)
+
+    return updater
+
+
+def get_webhook_secret_token(telegram_bot: str) -> str:
+    """
+    Returns an empty string if the Telegram Bot doesn't exist, or doesn't receive Updates on site
+    """
+    key = (frappe.local.site, telegram_bot)
+    version = get_webhook_secret_version()
+    cached = webhook_secret_cache.get(key)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+
+    secret_token = ""
+    if frappe.db.get_value("Telegram Bot", telegram_bot, "receive_updates_on_site"):
+        secret_token = get_decrypted_password(
+            "Telegram Bot", telegram_bot, "webhook_secret_token", raise_exception=False) or ""
+    if version is not None:
+        webhook_secret_cache.set(key, (version, secret_token))
+
+    return secret_token
+
+
+def clear_webhook_secret_cache():
+    """
+    Drops the secret tokens cached by every process of the site
+    """
+    redis = frappe.cache()
+    redis.incr(redis.make_key(WEBHOOK_SECRET_VERSION_KEY))
+
+
+def get_webhook_secret_version():
+    """
+    Returns None when redis can't be reached, in which case nothing is read from the cache
+    """
+    redis = frappe.cache()
+    try:
+        return int(redis.get(redis.make_key(WEBHOOK_SECRET_VERSION_KEY)) or 0)
+    except Exception:
+        return None
+
+
+def get_webhook_rq_queue() -> str:
+    from frappe.utils.background_jobs import get_queues_timeout
+
+    if WEBHOOK_RQ_QUEUE in get_queues_timeout():
+        return WEBHOOK_RQ_QUEUE
+
+    return "short"
+
+
+def get_site_webhook_url(telegram_bot: str) -> str:
+    from urllib.parse import quote
+    from frappe.utils import get_url
+
+    return get_url("/api/method/frappe_telegram.bot.receive_webhook_update?telegram_bot={}".format(
+        quote(telegram_bot)))
+
+
+def get_updater(
+        telegram_bot: Union[str, TelegramBot],
+        site: str,
+        persistent_connections=False,
+        update_workers=0,
+        processes=0,
+        buffered_logging=False,
+        update_queue_size=0) -> Updater:
+    """
+    Returns the Updater to start receiving Updates with.
+    With processes > 1, this is an ingress that fans Updates out to as many worker processes,
+    each of which runs its own bot made by `get_bot`
+    """
+    if processes > 1:
+        from .utils.process_pool import make_ingress
+        return make_ingress(
+            site=site, telegram_bot=telegram_bot, processes=processes,
+            persistent_connections=persistent_connections, update_workers=update_workers,
+            buffered_logging=buffered_logging, update_queue_size=update_queue_size)
+
+    return get_bot(
+        telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+        update_workers=update_workers, buffered_logging=buffered_logging,
+        update_queue_size=update_queue_size)
+
+
+def get_bot(
+        telegram_bot: Union[str, TelegramBot],
+        site=None,
+        persistent_connections=False,
+        update_workers=0,
+        buffered_logging=False,
+        scheduler=None,
+        request=None,
+        update_queue_size=0) -> Updater:
     if not site:
         site = frappe.local.site
 
@@ -42,7 +328,10 @@ def get_bot(telegram_bot: Union[str, TelegramBot], site=None) -> Updater:
         if isinstance(telegram_bot, str):
             telegram_bot = frappe.get_doc("Telegram Bot", telegram_bot)
 
-        updater = make_bot(telegram_bot=telegram_bot, site=site)
+        updater = make_bot(
+            telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+            update_workers=update_workers, buffered_logging=buffered_logging,
+            scheduler=scheduler, request=request, update_queue_size=update_queue_size)
         # dispatcher = updater.dispatcher
 
         handlers = frappe.get_hooks("telegram_bot_handler")
@@ -52,29 +341,93 @@ def get_bot(telegram_bot: Union[str, TelegramBot], site=None) -> Updater:
             frappe.get_attr(cmd)(telegram_bot=telegram_bot, updater=updater)
 
         attach_update_processors(dispatcher=updater.dispatcher)
+        updater.dispatcher.allowed_updates = get_allowed_updates(
+            telegram_bot, dispatcher=updater.dispatcher)
+        cache_handled_update_types(telegram_bot.name, updater.dispatcher)
 
     return updater
 
 
-def make_bot(telegram_bot: TelegramBot, site: str) -> Updater:
+def make_bot(
+        telegram_bot: TelegramBot,
+        site: str,
+        persistent_connections=False,
+        update_workers=0,
+        buffered_logging=False,
+        scheduler=None,
+        request=None,
+        update_queue_size=0) -> Updater:
     """
     Returns a custom TelegramUpdater with FrappeTelegramDispatcher
+    persistent_connections keeps the dispatcher's site context & db connection alive across Updates
+    update_workers > 1 processes Updates of different chats in parallel on as many threads
+    buffered_logging bulk inserts Telegram Messages in the background
+    scheduler is a worker pool shared with other bots, started & stopped by its owner
+    request is a pool of connections to Telegram shared with other bots
+    update_queue_size > 0 bounds the queue of Updates waiting for the dispatcher
     """
+    from queue import Queue
+    from telegram.ext import ExtBot
     from .utils.overrides import FrappeTelegramDispatcher, FrappeTelegramExtBot
 
-    updater = Updater(token=telegram_bot.get_password("api_token"))
+    if request:
+        updater = Updater(bot=ExtBot(telegram_bot.get_password("api_token"), request=request))
+    else:
+        updater = Updater(token=telegram_bot.get_password("api_token"))
+    if update_queue_size:
+        updater.update_queue = Queue(maxsize=update_queue_size)
     # Override ExtBot
     updater.bot = FrappeTelegramExtBot.make(telegram_bot=telegram_bot.name, updater=updater)
 
     # Override Dispatcher
     frappe_dispatcher = FrappeTelegramDispatcher.make(
-        site=site, updater=updater)
+        site=site, updater=updater, persistent_connections=persistent_connections,
+        update_workers=update_workers, buffered_logging=buffered_logging, scheduler=scheduler)
     updater.dispatcher = frappe_dispatcher
     updater.job_queue.set_dispatcher(frappe_dispatcher)
 
     return updater
 
 
+def get_allowed_updates(telegram_bot: TelegramBot, dispatcher: Dispatcher = None) -> list:
+    """
+    Returns the types of Update Telegram has to send the bot: the ones set on the Telegram Bot,
+    or else the ones its handlers can match. An empty list gets all types but chat_member.
+    Without the dispatcher, the types last cached by a process that set up the handlers
+    """
+    if telegram_bot.allowed_updates:
+        return get_update_types(telegram_bot.allowed_updates)
+
+    if not dispatcher:
+        return get_cached_handled_update_types(telegram_bot.name)
+
+    return get_handled_update_types(dispatcher.handlers) or []
+
+
+def cache_handled_update_types(telegram_bot: str, dispatcher: Dispatcher):
+    """
+    Keeps the types of Update the handlers of the bot can match, for processes that don't set up
+    the handlers themselves (eg: Set Site Webhook from Desk)
+    """
+    update_types = get_handled_update_types(dispatcher.handlers) or []
+    frappe.cache().hset(HANDLED_UPDATE_TYPES_KEY, telegram_bot, update_types)
+
+
+def get_cached_handled_update_types(telegram_bot: str) -> Union[list, None]:
+    """
+    Returns None until a process has set up the handlers of the bot, in which case Telegram keeps
+    sending the types of Update it was last asked for
+    """
+    return frappe.cache().hget(HANDLED_UPDATE_TYPES_KEY, telegram_bot)
+
+
+def get_update_types(value: str) -> list:
+    """
+    Splits the allowed_updates of a Telegram Bot, given one per line or comma separated
+    """
+    return [x for x in re.split(r"[\s,]+", value or "") if x]
+
+
 def attach_update_processors(dispatcher: Dispatcher):
     pre_process_group = dispatcher.groups[0] - 1000
     post_process_group = dispatcher.groups[-1] + 1000
@@ -1,12 +1,16 @@
 import os
+import threading
+from pathlib import PurePath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import frappe
-from frappe import _
 from frappe.core.doctype.file.file import File
-from frappe.utils.jinja import render_template
 from frappe_telegram import Bot, ParseMode
 from frappe_telegram.utils.formatting import strip_unsupported_html_tags
 from frappe_telegram.frappe_telegram.doctype.telegram_bot import DEFAULT_TELEGRAM_BOT_KEY
 from frappe_telegram.handlers.logging import log_outgoing_message
+from frappe_telegram.utils.rate_limit import RateLimiter, SharedRateLimiter
+from frappe_telegram.utils.upload import send_document_streamed
 
 """
 The functions defined here is provided to invoke the bot
@@ -14,6 +18,14 @@ without Updaters & Dispatchers. This is helpful for triggering
 bot interactions via Hooks / Controller methods
 """
 
+# Starts of the (lowercased) BadRequest messages Telegram sends back for a file_id it can't send
+UNKNOWN_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "wrong file_id",
+    "type of file mismatch",
+)
+
 
 def send_message(message_text: str, parse_mode=None, user=None, telegram_user=None, from_bot=None):
     """
@@ -65,9 +77,267 @@ def send_file(file, filename=None, message=None, parse_mode=None, user=None, tel
     if not from_bot:
         from_bot = frappe.db.get_default(DEFAULT_TELEGRAM_BOT_KEY)
 
+    bot = get_bot(from_bot)
+    content = get_file_content(file)
+    if content is not None:
+        result = send_document_cached(
+            bot, telegram_user_id, content, telegram_bot=from_bot, filename=filename,
+            caption=message, parse_mode=parse_mode)
+    else:
+        result = bot.send_document(telegram_user_id, document=file, filename=filename,
+                                   caption=message, parse_mode=parse_mode)
+    log_outgoing_message(telegram_bot=from_bot, result=result)
+
+
+def send_bulk(message_text: str, users: list = None, telegram_users: list = None, parse_mode=None,
+              from_bot=None, on_progress=None, max_retries=3) -> dict:
+    """
+    Send the same message to many Telegram Users, within Telegram's rate limits
+
+    message_text: `str`
+        A text string between 0 and 4096 characters that will be the message
+    parse_mode: `ParseMode`
+        Choose styling for your message using a ParseMode class constant. Default is `None`
+    users: `list`
+        Users linked to the Telegram Users to send the message to
+    telegram_users: `list`
+        Telegram Users to send the message to
+    from_bot: `str`
+        Explicitly specify a bot name to send message from; the default is used if none specified
+    on_progress: `callable`
+        Called as on_progress(done, total) after each recipient is dealt with
+    max_retries: `int`
+        Times a message is retried after Telegram asked to slow down (RetryAfter)
+
+    Returns a dict with the Telegram Users `sent` to, the ones `failed` with their errors,
+    and the `unresolved` users / telegram_users that are not linked to any Telegram User
+    """
+
+    message_text = sanitize_message_text(message_text, parse_mode)
+
+    recipients, result = resolve_recipients(users=users, telegram_users=telegram_users)
+    _send_bulk(
+        "send_message", recipients, result, from_bot=from_bot, on_progress=on_progress,
+        max_retries=max_retries, text=message_text, parse_mode=parse_mode)
+
+    return result
+
+
+def send_file_bulk(file, filename=None, message=None, parse_mode=None, users: list = None,
+                   telegram_users: list = None, from_bot=None, on_progress=None,
+                   max_retries=3) -> dict:
+    """
+    Send the same file to many Telegram Users, within Telegram's rate limits.
+    Takes the same file arguments as `send_file`, and returns the same result as `send_bulk`.
+
+    The file is uploaded only once: every other recipient is sent the `file_id` that Telegram
+    returned for the first upload. The file_id is also returned in the result, for reuse.
+    URLs are fetched by Telegram once, the same way. Internal files that don't exist are rejected
+    """
+
+    message = sanitize_message_text(message, parse_mode)
+    if hasattr(file, "read"):
+        # A file handle would be exhausted after the first recipient. Stream the file it was
+        # opened from if there is one, or else read it once
+        with file:
+            file_name = getattr(file, "name", None)
+            if isinstance(file_name, str) and os.path.isfile(file_name):
+                file = PurePath(os.path.abspath(file_name))
+            else:
+                file = file.read()
+
+    if not from_bot:
+        from_bot = frappe.db.get_default(DEFAULT_TELEGRAM_BOT_KEY)
+
+    content = get_file_content(file)
+    if content is None and is_internal_file(file):
+        frappe.throw(frappe._("File not found: {0}").format(
+            file.file_url if isinstance(file, File) else file), frappe.DoesNotExistError)
+
+    recipients, result = resolve_recipients(users=users, telegram_users=telegram_users)
+    result.file_id = file if content is None and is_file_id(file) else None
+    kwargs = dict(filename=filename, caption=message, parse_mode=parse_mode)
+
+    if content is not None:
+        method, document = send_document_cached, content
+        kwargs["telegram_bot"] = from_bot
+    else:
+        method, document = "send_document", file
+
+    # Upload to one recipient at a time, until an upload succeeds
+    bot = get_bot(from_bot)
+    limiter = get_rate_limiter(from_bot)
+    while recipients and not result.file_id:
+        telegram_user, (user, telegram_user_id) = recipients.popitem()
+        try:
+            sent = send_rate_limited(
+                bot, limiter, telegram_user_id, method=method, max_retries=max_retries,
+                document=document, **kwargs)
+            log_outgoing_message(telegram_bot=from_bot, result=sent)
+            result.sent.append(telegram_user)
+            result.file_id = getattr(sent.effective_attachment, "file_id", None)
+        except Exception as e:
+            result.failed[telegram_user] = str(e)
+
+    kwargs.pop("telegram_bot", None)
+    if recipients:
+        _send_bulk(
+            "send_document", recipients, result, from_bot=from_bot, on_progress=on_progress,
+            max_retries=max_retries, document=result.file_id, **kwargs)
+
+    return result
+
+
+def resolve_recipients(users: list = None, telegram_users: list = None):
+    """
+    Returns the resolved recipients, along with a bulk send result listing the unresolved ones
+    """
+    recipients = get_telegram_user_ids(users=users, telegram_users=telegram_users)
+    resolved = set(recipients.keys())
+    resolved.update(user for user, telegram_user_id in recipients.values())
+    unresolved = [x for x in (users or []) + (telegram_users or []) if x not in resolved]
+
+    return recipients, frappe._dict(sent=[], failed={}, unresolved=unresolved)
+
+
+def _send_bulk(method: str, recipients: dict, result: dict, from_bot=None, on_progress=None,
+               max_retries=3, **kwargs) -> list:
+    """
+    Sends to all recipients, recording them in result.sent / result.failed.
+    Returns the messages sent
+    """
+    if not from_bot:
+        from_bot = frappe.db.get_default(DEFAULT_TELEGRAM_BOT_KEY)
+
+    bot = get_bot(from_bot)
+    limiter = get_rate_limiter(from_bot)
+    messages = []
+
+    def _send(telegram_user_id):
+        return send_rate_limited(
+            bot, limiter, telegram_user_id, method=method, max_retries=max_retries, **kwargs)
+
+    # Sends happen on the bot's connection pool; logging stays on this thread's db connection
+    with ThreadPoolExecutor(max_workers=BOT_CONNECTION_POOL_SIZE) as executor:
+        futures = {
+            executor.submit(_send, telegram_user_id): telegram_user
+            for telegram_user, (user, telegram_user_id) in recipients.items()}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            telegram_user = futures[future]
+            try:
+                message = future.result()
+                log_outgoing_message(telegram_bot=from_bot, result=message)
+                result.sent.append(telegram_user)
+                messages.append(message)
+            except Exception as e:
+                result.failed[telegram_user] = str(e)
+
+            if on_progress:
+                on_progress(done, len(futures))
+
+    return messages
+
+
+def get_rate_limiter(telegram_bot: str) -> RateLimiter:
+    """
+    Returns a RateLimiter sharing the overall rate of the bot with every other bulk send, for eg:
+    the notification chunk jobs running on other RQ workers
+    """
+    return SharedRateLimiter(
+        frappe.cache(), frappe.cache().make_key(f"telegram_bot_send_slot|{telegram_bot}"))
+
+
+def send_rate_limited(bot: Bot, limiter: RateLimiter, chat_id, method="send_message",
+                      max_retries=3, **kwargs):
+    """
+    Sends a message once the limiter allows it. `method` is either the name of a Bot method, or
+    a function called as method(bot, chat_id, **kwargs). On a RetryAfter, all sends through the
+    limiter are held off for the time Telegram asked for, and the message is retried
+    """
+    from telegram.error import RetryAfter
+
+    retries = 0
+    while True:
+        limiter.acquire(chat_id)
+        try:
+            if callable(method):
+                return method(bot, chat_id, **kwargs)
+            return getattr(bot, method)(chat_id, **kwargs)
+        except RetryAfter as e:
+            if retries >= max_retries:
+                raise
+            retries += 1
+            limiter.pause(e.retry_after)
+
+
+def send_document_cached(bot: Bot, chat_id, document, telegram_bot: str, **kwargs):
+    """
+    Sends a file's content, reusing the file_id of an earlier upload of the same content by
+    the same bot. The file_id of a new upload is recorded in Telegram File Cache
+
+    document: (`bytes` | `str`)
+        The content itself, or the path of a file on disk
+    """
+    from telegram.error import BadRequest
+    from frappe_telegram.frappe_telegram.doctype.telegram_file_cache.telegram_file_cache import (
+        get_content_hash, get_cached_file_id, set_cached_file_id, clear_cached_file_id)
+
+    content_hash = get_content_hash(document)
+    file_id = get_cached_file_id(telegram_bot, content_hash)
+    if file_id:
+        try:
+            return bot.send_document(chat_id, document=file_id, **kwargs)
+        except BadRequest as e:
+            if not is_unknown_file_id_error(e):
+                raise
+            # Telegram doesn't know the file_id anymore
+            clear_cached_file_id(telegram_bot, content_hash)
+
+    if isinstance(document, bytes):
+        message = bot.send_document(chat_id, document=document, **kwargs)
+    else:
+        message = send_document_streamed(bot, chat_id, document, **kwargs)
+
+    file_id = getattr(message.effective_attachment, "file_id", None)
+    if file_id:
+        set_cached_file_id(
+            telegram_bot, content_hash, file_id,
+            file_name=kwargs.get("filename") or (
+                None if isinstance(document, bytes) else os.path.basename(document)))
+
+    return message
+
+
+def is_unknown_file_id_error(error) -> bool:
+    """
+    Whether Telegram rejected a file_id it doesn't know (anymore), or can't send as a document
+    """
+    return str(error).lower().startswith(UNKNOWN_FILE_ID_ERRORS)
+
+
+def get_file_content(file):
+    """
+    Returns what send_document_cached can hash & upload: the path of files on disk, or bytes.
+    Files on disk are streamed, and never read into memory as a whole.
+    None for everything else (file_ids, URLs, file handles etc)
+    """
+    if isinstance(file, bytes):
+        return file
+
+    return get_file_path(file)
+
+
+def get_file_path(file):
+    """
+    Resolves File docs, internal file paths & pathlib.Path to the path of the file on disk
+    """
     if isinstance(file, File):
         file = file.file_url
 
+    if isinstance(file, PurePath):
+        return str(file) if os.path.exists(file) else None
+
     if isinstance(file, str) and "/files/" in file:
 
         # If file is string, check that the url is internal
@@ -76,12 +346,53 @@ def send_file(file, filename=None, message=None, parse_mode=None, user=None, tel
             (("" if "/private/" in file else "/public") + file).strip("/"))
 
         if os.path.exists(file_path):
-            file = open(file_path, 'rb')
+            return file_path
 
-    bot = get_bot(from_bot)
-    result = bot.send_document(telegram_user_id, document=file, filename=filename, caption=message,
-                               parse_mode=parse_mode)
-    log_outgoing_message(telegram_bot=from_bot, result=result)
+    return None
+
+
+def is_internal_file(file) -> bool:
+    """
+    Whether the file refers to a file on disk: a File doc, an internal file path or a pathlib.Path
+    """
+    if isinstance(file, (File, PurePath)):
+        return True
+
+    return isinstance(file, str) and "/files/" in file and not is_url(file)
+
+
+def is_url(file) -> bool:
+    return isinstance(file, str) and file.startswith(("http://", "https://"))
+
+
+def is_file_id(file) -> bool:
+    """
+    Whether the file is the file_id of a file already on Telegram
+    """
+    return isinstance(file, str) and not is_url(file) and not is_internal_file(file)
+
+
+def get_telegram_user_ids(users: list = None, telegram_users: list = None) -> dict:
+    """
+    Resolves Users / Telegram Users in a single query
+
+    Returns a dict of Telegram User name: (user, telegram_user_id)
+    """
+    or_filters = []
+    if users:
+        or_filters.append(["user", "in", list(users)])
+    if telegram_users:
+        or_filters.append(["name", "in", list(telegram_users)])
+
+    if not or_filters:
+        return dict()
+
+    return {
+        x.name: (x.user, x.telegram_user_id)
+        for x in frappe.get_all(
+            "Telegram User", or_filters=or_filters, fields=["name", "user", "telegram_user_id"])
+        if x.telegram_user_id
+    }
 
 
 def get_telegram_user_id(user=None, telegram_user=None):
@@ -101,15 +412,55 @@ def get_telegram_user_id(user=None, telegram_user=None):
     return telegram_user_id
 
 
+# Telegram Bot name: (modified, ExtBot)
+_bot_registry = {}
+_bot_registry_lock = threading.Lock()
+
+# Keep-alive connections kept open per bot
+BOT_CONNECTION_POOL_SIZE = 4
+
+
 def get_bot(telegram_bot) -> Bot:
+    """
+    Returns the long-lived bot of a Telegram Bot, shared process-wide.
+    Reusing it saves decrypting the api_token and a new TLS handshake on every message.
+    The bot is rebuilt when the Telegram Bot is modified, for eg: when its api_token changes
+    """
+    modified = frappe.get_cached_value("Telegram Bot", telegram_bot, "modified")
+    entry = _bot_registry.get(telegram_bot)
+    if entry and entry[0] == modified:
+        return entry[1]
+
+    with _bot_registry_lock:
+        entry = _bot_registry.get(telegram_bot)
+        if entry and entry[0] == modified:
+            return entry[1]
+
+        bot = make_bot(telegram_bot)
+        _bot_registry[telegram_bot] = (modified, bot)
+
+    return bot
+
+
+def make_bot(telegram_bot) -> Bot:
     from telegram.ext import ExtBot
+    from telegram.utils.request import Request
     telegram_bot = frappe.get_doc("Telegram Bot", telegram_bot)
 
     return ExtBot(
-        token=telegram_bot.get_password("api_token")
+        token=telegram_bot.get_password("api_token"),
+        request=Request(con_pool_size=BOT_CONNECTION_POOL_SIZE)
     )
 
 
+def clear_bot_registry(telegram_bot=None):
+    with _bot_registry_lock:
+        if telegram_bot:
+            _bot_registry.pop(telegram_bot, None)
+        else:
+            _bot_registry.clear()
+
+
 @frappe.whitelist()
 def send_message_from_template(template: str, context: dict = None, lang: str = None,
                                parse_mode=None, user=None, telegram_user=None, from_bot=None):
@@ -140,32 +491,13 @@ def render_message_from_template(template: str, context: dict = None, lang: str
     lang: `str`
         Optionally can be set if an alternative template language is needed
     """
-    dt = "Telegram Message Template"
-
-    templates = frappe.get_all(
-        dt,
-        filters=[{"name": template}]
-    )
-
-    if not templates:
-        frappe.throw(_("No template with name '{0}' exists.").format(template))
-
-    template_doc = frappe.get_doc(dt, templates[0].name)
+    from frappe_telegram.frappe_telegram.doctype.telegram_message_template.telegram_message_template \
+        import get_compiled_template
 
     if not context:
         context = {}
 
-    template = ""
-
-    if lang:
-        for translation in template_doc.template_translations:
-            if translation.language == lang:
-                template = translation.template
-
-    if not template:
-        template = template_doc.default_template
-
-    return render_template(template, context)
+    return get_compiled_template(template, lang=lang).render(context)
 
 
 def validate_parse_mode(parse_mode: ParseMode) -> None:
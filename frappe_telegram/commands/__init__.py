@@ -4,8 +4,10 @@ import frappe
 import logging
 from frappe.commands import pass_context, get_site
 
-from frappe_telegram.bot import start_polling, start_webhook
+from frappe_telegram.bot import start_polling, start_webhook, start_bots as _start_bots
 from frappe_telegram.utils.supervisor import add_supervisor_entry, remove_supervisor_entry
+from frappe_telegram.utils.webhook import OVERFLOW_POLICIES, WEBHOOK_QUEUE_SIZE
+from frappe_telegram.utils.polling import DRAIN_TIMEOUT
 
 
 @click.group("telegram")
@@ -23,11 +25,30 @@ def telegram():
               help="The port to listen on for webhook events. Default is 8080")
 @click.option("--webhook-url", type=str,
               help="Explicitly specify webhook URL. Useful for NAT, reverse-proxy etc")
+@click.option("--persistent-connections", is_flag=True,
+              help="Keep the site context & db connection alive across updates")
+@click.option("--update-workers", type=int, default=0,
+              help="Process updates of different chats in parallel on N threads")
+@click.option("--processes", type=int, default=0,
+              help="Fan updates out to N worker processes, routed by chat")
+@click.option("--buffered-logging", is_flag=True,
+              help="Bulk insert Telegram Messages in the background")
+@click.option("--webhook-queue-size", type=int, default=WEBHOOK_QUEUE_SIZE,
+              help="Max updates queued by the webhook server. Default is {}".format(
+                  WEBHOOK_QUEUE_SIZE))
+@click.option("--webhook-overflow", type=click.Choice(OVERFLOW_POLICIES), default="reject",
+              help="What to do with webhook updates while the queue is full. Default is reject")
+@click.option("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+              help="Seconds to let polled updates in flight complete on shutdown. "
+                   "Default is {}".format(DRAIN_TIMEOUT))
 @pass_context
 def start_bot(
         context, telegram_bot,
         polling=False, poll_interval=0,
-        webhook=False, webhook_port=8080, webhook_url=None):
+        webhook=False, webhook_port=8080, webhook_url=None,
+        persistent_connections=False, update_workers=0, processes=0,
+        buffered_logging=False, webhook_queue_size=WEBHOOK_QUEUE_SIZE,
+        webhook_overflow="reject", drain_timeout=DRAIN_TIMEOUT):
     """
     Start Telegram Bot
 
@@ -50,11 +71,54 @@ def start_bot(
     )
 
     if polling:
-        start_polling(site=site, telegram_bot=telegram_bot, poll_interval=poll_interval)
+        start_polling(
+            site=site, telegram_bot=telegram_bot, poll_interval=poll_interval,
+            persistent_connections=persistent_connections, update_workers=update_workers,
+            processes=processes, buffered_logging=buffered_logging, drain_timeout=drain_timeout)
     elif webhook:
         start_webhook(
             site=site, telegram_bot=telegram_bot,
-            webhook_port=webhook_port, webhook_url=webhook_url)
+            webhook_port=webhook_port, webhook_url=webhook_url,
+            persistent_connections=persistent_connections, update_workers=update_workers,
+            processes=processes, buffered_logging=buffered_logging,
+            webhook_queue_size=webhook_queue_size, webhook_overflow=webhook_overflow)
+
+
+@click.command("start-bots")
+@click.argument("telegram_bots", nargs=-1)
+@click.option("--poll-interval", type=float, default=0,
+              help="Time interval between each poll. Default is 0")
+@click.option("--persistent-connections", is_flag=True,
+              help="Keep the site context & db connection alive across updates")
+@click.option("--update-workers", type=int, default=4,
+              help="Threads shared by all the bots to process updates on. Default is 4")
+@click.option("--buffered-logging", is_flag=True,
+              help="Bulk insert Telegram Messages in the background")
+@click.option("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+              help="Seconds to let updates in flight complete on shutdown. "
+                   "Default is {}".format(DRAIN_TIMEOUT))
+@pass_context
+def start_bots(
+        context, telegram_bots, poll_interval=0, persistent_connections=False,
+        update_workers=4, buffered_logging=False, drain_timeout=DRAIN_TIMEOUT):
+    """
+    Start many Telegram Bots in a single process, in polling mode
+
+    \b
+    Args:
+        telegram_bots: The names of 'Telegram Bot's to start. All of them if none specified
+    """
+    site = get_site(context)
+
+    # Enable logging
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.DEBUG
+    )
+
+    _start_bots(
+        site=site, telegram_bots=list(telegram_bots), poll_interval=poll_interval,
+        persistent_connections=persistent_connections, update_workers=update_workers,
+        buffered_logging=buffered_logging, drain_timeout=drain_timeout)
 
 
 @click.command("list-bots")
@@ -72,6 +136,24 @@ def list_bots(context):
     frappe.destroy()
 
 
+@click.command("bot-stats")
+@click.argument("telegram_bot")
+@pass_context
+def bot_stats(context, telegram_bot):
+    """
+    Prints the runtime stats last reported by a running bot
+    """
+    import json
+    from frappe_telegram.utils.stats import get_bot_stats
+
+    site = get_site(context)
+    frappe.init(site=site)
+
+    print(json.dumps(get_bot_stats(telegram_bot), indent=2, default=str))
+
+    frappe.destroy()
+
+
 @click.command("supervisor-add")
 @click.argument("telegram_bot")
 @click.option("--polling", is_flag=True, help="Start bot in Polling Mode")
@@ -82,11 +164,29 @@ def list_bots(context):
               help="The port to listen on for webhook events. Default is 8080")
 @click.option("--webhook-url", type=str,
               help="Explicitly specify webhook URL. Useful for NAT, reverse-proxy etc")
+@click.option("--persistent-connections", is_flag=True,
+              help="Keep the site context & db connection alive across updates")
+@click.option("--update-workers", type=int, default=0,
+              help="Process updates of different chats in parallel on N threads")
+@click.option("--processes", type=int, default=0,
+              help="Fan updates out to N worker processes, routed by chat")
+@click.option("--buffered-logging", is_flag=True,
+              help="Bulk insert Telegram Messages in the background")
+@click.option("--webhook-queue-size", type=int, default=0,
+              help="Max updates queued by the webhook server. Default is {}".format(
+                  WEBHOOK_QUEUE_SIZE))
+@click.option("--webhook-overflow", type=click.Choice(OVERFLOW_POLICIES),
+              help="What to do with webhook updates while the queue is full. Default is reject")
+@click.option("--drain-timeout", type=float, default=0,
+              help="Seconds to let polled updates in flight complete on shutdown. "
+                   "Default is {}".format(DRAIN_TIMEOUT))
 @pass_context
 def supervisor_add(
         context, telegram_bot,
         polling=False, poll_interval=0,
-        webhook=False, webhook_port=8080, webhook_url=None):
+        webhook=False, webhook_port=8080, webhook_url=None,
+        persistent_connections=False, update_workers=0, processes=0,
+        buffered_logging=False, webhook_queue_size=0, webhook_overflow=None, drain_timeout=0):
     """
     Sets up supervisor process
     """
@@ -99,7 +199,11 @@ def supervisor_add(
 
     add_supervisor_entry(
         telegram_bot=telegram_bot, polling=polling, poll_interval=poll_interval,
-        webhook=webhook, webhook_port=webhook_port, webhook_url=webhook_url)
+        webhook=webhook, webhook_port=webhook_port, webhook_url=webhook_url,
+        persistent_connections=persistent_connections, update_workers=update_workers,
+        processes=processes, buffered_logging=buffered_logging,
+        webhook_queue_size=webhook_queue_size, webhook_overflow=webhook_overflow,
+        drain_timeout=drain_timeout)
 
     frappe.destroy()
 
@@ -176,7 +280,9 @@ def nginx_remove(context, telegram_bot):
 
 
 telegram.add_command(start_bot)
+telegram.add_command(start_bots)
 telegram.add_command(list_bots)
+telegram.add_command(bot_stats)
 telegram.add_command(supervisor_add)
 telegram.add_command(supervisor_remove)
 telegram.add_command(nginx_add)
@@ -13,12 +13,33 @@ class TelegramBot(Document):
     def validate(self):
         self.validate_api_token()
         self.set_nginx_path()
+        self.set_webhook_secret_token()
+        self.validate_allowed_updates()
+
+    def before_save(self):
+        self.set_last_update_id()
 
     def after_insert(self):
         default_bot = frappe.db.get_default(DEFAULT_TELEGRAM_BOT_KEY)
         if not default_bot:
             self.mark_as_default()
 
+    def on_update(self):
+        from frappe_telegram.client import clear_bot_registry
+        from frappe_telegram.bot import clear_webhook_secret_cache
+        clear_bot_registry(self.name)
+        clear_webhook_secret_cache()
+
+    def on_trash(self):
+        from frappe_telegram.client import clear_bot_registry
+        from frappe_telegram.bot import clear_webhook_secret_cache
+        from frappe_telegram.frappe_telegram.doctype.telegram_file_cache.telegram_file_cache \
+            import clear_cached_file_id
+        clear_bot_registry(self.name)
+        clear_webhook_secret_cache()
+        # file_ids are only valid for the bot that uploaded them
+        clear_cached_file_id(self.name)
+
     def after_delete(self):
         default_bot = frappe.db.get_default(DEFAULT_TELEGRAM_BOT_KEY)
 
@@ -40,6 +61,51 @@ class TelegramBot(Document):
 
         self.webhook_nginx_path = "/" + self.webhook_url.rstrip("/").split("/")[-1]
 
+    def validate_allowed_updates(self):
+        from frappe_telegram.bot import get_update_types
+        from frappe_telegram.utils.routing import UPDATE_TYPES
+
+        invalid = [x for x in get_update_types(self.allowed_updates) if x not in UPDATE_TYPES]
+        if invalid:
+            frappe.throw(frappe._("Unknown Update types: {0}").format(", ".join(invalid)))
+
+    def set_webhook_secret_token(self):
+        if not self.receive_updates_on_site or self.webhook_secret_token:
+            return
+
+        # Telegram allows 1-256 characters of A-Z, a-z, 0-9, _ and -
+        self.webhook_secret_token = frappe.generate_hash(length=32)
+
+    @frappe.whitelist()
+    def set_site_webhook(self):
+        """
+        Points the bot's webhook to this site, along with the secret token it has to send back
+        """
+        from frappe_telegram.bot import get_site_webhook_url, get_allowed_updates
+        from frappe_telegram.client import get_bot
+
+        if not self.receive_updates_on_site:
+            frappe.throw(frappe._("Enable Receive Updates on Site first"))
+
+        url = get_site_webhook_url(self.name)
+        get_bot(self.name).set_webhook(
+            url=url, allowed_updates=get_allowed_updates(self),
+            api_kwargs=dict(secret_token=self.get_password("webhook_secret_token")))
+        frappe.msgprint(frappe._("Webhook set to {0}").format(url))
+
+    def set_last_update_id(self):
+        """
+        last_update_id is kept up to date by the polling process, see `utils/polling.py`.
+        A save must not write back the value the Telegram Bot was loaded with
+        """
+        if self.is_new() or self.has_value_changed("api_token"):
+            # Update ids are per bot
+            self.last_update_id = 0
+        else:
+            # Locked until saved, so that the polling process can't save in between
+            self.last_update_id = frappe.db.get_value(
+                "Telegram Bot", self.name, "last_update_id", for_update=True)
+
     @frappe.whitelist()
     def mark_as_default(self):
         frappe.db.set_default(DEFAULT_TELEGRAM_BOT_KEY, self.name)
@@ -1,8 +1,13 @@
 # Copyright (c) 2021, Leam Technology Systems and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 class TelegramBotItem(Document):
 	pass
+
+
+def on_doctype_update():
+	# Membership lookups of a bot within a chat; also keeps concurrent inserts from duplicating it
+	frappe.db.add_unique("Telegram Bot Item", ["parent", "parentfield", "telegram_bot"])
@@ -1,17 +1,174 @@
 # Copyright (c) 2021, Leam Technology Systems and contributors
 # For license information, please see license.txt
 
-# import frappe
+from typing import NamedTuple, Optional
+
+import frappe
 from frappe.model.document import Document
+from frappe_telegram.utils.cache import TTLCache
+
+"""
+Group chats can have thousands of members. Loading & saving the whole Telegram Chat to track them
+does not scale, so on the Update hot path:
+- Telegram Chats are resolved as read-only snapshots without their child tables, and cached
+  in-process by chat_id
+- Members are looked up by a unique index on (parent, parentfield, member), and appended as
+  single rows
+- Memberships are remembered in-process once committed
+"""
+telegram_chat_cache = TTLCache(maxsize=10000, ttl=300)
+
+# (chat, parentfield, member) known to be recorded
+known_chat_members = TTLCache(maxsize=100000, ttl=3600)
+
+CHAT_MEMBER_TABLES = {
+    "users": ("Telegram User Item", "telegram_user"),
+    "bots": ("Telegram Bot Item", "telegram_bot"),
+}
+
+CHAT_FIELDS = ["name", "chat_id", "title", "type", "last_message_on", "last_message_content"]
+
+
+class TelegramChatSnapshot(NamedTuple):
+    name: str
+    chat_id: str
+    title: Optional[str]
+    type: Optional[str]
+    last_message_on: object
+    last_message_content: Optional[str]
+
+    def get_doc(self) -> "TelegramChat":
+        return frappe.get_doc("Telegram Chat", self.name)
+
+    def get_bot(self):
+        return get_chat_bot(frappe.db.get_value(
+            "Telegram Bot Item",
+            {"parent": self.name, "parenttype": "Telegram Chat", "parentfield": "bots"},
+            "telegram_bot", order_by="idx asc"))
 
 
 class TelegramChat(Document):
     def validate(self):
         pass
 
+    def on_update(self):
+        telegram_chat_cache.pop(str(self.chat_id))
+
+        members = self.get_members()
+        previous = self.get_doc_before_save()
+        if previous:
+            for member in previous.get_members() - members:
+                known_chat_members.pop((self.name, ) + member)
+
+        remember_chat_members(self.name, members)
+
+    def on_trash(self):
+        telegram_chat_cache.pop(str(self.chat_id))
+        for member in self.get_members():
+            known_chat_members.pop((self.name, ) + member)
+
+    def get_members(self) -> set:
+        """
+        Returns the (parentfield, member) of the users & bots tables
+        """
+        members = set()
+        for parentfield, (_, fieldname) in CHAT_MEMBER_TABLES.items():
+            members.update((parentfield, row.get(fieldname)) for row in self.get(parentfield))
+
+        return members
+
+    def get_snapshot(self) -> TelegramChatSnapshot:
+        return TelegramChatSnapshot(**{field: self.get(field) for field in CHAT_FIELDS})
+
     def get_bot(self):
-        if not len(self.bots):
-            return None
+        return get_chat_bot(self.bots[0].telegram_bot if len(self.bots) else None)
+
+
+def get_chat_bot(telegram_bot: str):
+    if not telegram_bot:
+        return None
+
+    from frappe_telegram.client import get_bot
+    return get_bot(telegram_bot)
+
+
+def on_doctype_update():
+    # Keyset pagination of chats in the Telegram Chat View
+    frappe.db.add_index("Telegram Chat", ["last_message_on", "name"])
+
+
+def get_telegram_chat_by_id(chat_id) -> Optional[TelegramChatSnapshot]:
+    """
+    Returns the Telegram Chat with the given chat_id, or None if there is none yet.
+    The users & bots child tables are not part of it; use `has_chat_member` instead,
+    or `get_doc` for the whole Telegram Chat
+    """
+    chat_id = str(chat_id)
+    chat = telegram_chat_cache.get(chat_id)
+    if chat is not None:
+        return chat
+
+    values = frappe.db.get_value("Telegram Chat", {"chat_id": chat_id}, CHAT_FIELDS, as_dict=1)
+    if not values:
+        return None
+
+    chat = TelegramChatSnapshot(**values)
+    telegram_chat_cache.set(chat_id, chat)
+
+    return chat
+
+
+def remember_chat_members(chat: str, members: set):
+    """
+    Remembers the (parentfield, member) of the chat once the transaction recording them commits.
+    A rolled back membership is thus never remembered
+    """
+    def remember():
+        for parentfield, member in members:
+            known_chat_members.set((chat, parentfield, member), True)
+
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(remember)
+    # Else, it is remembered when next looked up
+
+
+def has_chat_member(chat: str, parentfield: str, member: str) -> bool:
+    if (chat, parentfield, member) in known_chat_members:
+        return True
+
+    doctype, fieldname = CHAT_MEMBER_TABLES[parentfield]
+    if not frappe.db.exists(doctype, {
+            "parent": chat, "parenttype": "Telegram Chat", "parentfield": parentfield,
+            fieldname: member}):
+        return False
+
+    known_chat_members.set((chat, parentfield, member), True)
+    return True
+
+
+def add_chat_member(chat: str, parentfield: str, member: str):
+    """
+    Appends a member to the chat's users / bots table, if not there already.
+    Only the new row is inserted; the Telegram Chat itself is not touched
+    """
+    if has_chat_member(chat, parentfield, member):
+        return
+
+    doctype, fieldname = CHAT_MEMBER_TABLES[parentfield]
+    idx = frappe.db.sql(
+        f"SELECT IFNULL(MAX(idx), 0) + 1 FROM `tab{doctype}` WHERE parent=%s AND parentfield=%s",
+        (chat, parentfield))[0][0]
+
+    row = frappe.get_doc({
+        "doctype": doctype, "parent": chat, "parenttype": "Telegram Chat",
+        "parentfield": parentfield, "idx": idx, fieldname: member,
+        "owner": frappe.session.user, "modified_by": frappe.session.user,
+    })
+    try:
+        row.db_insert()
+    except frappe.UniqueValidationError:
+        # Recorded concurrently by another process
+        pass
 
-        from frappe_telegram.client import get_bot
-        return get_bot(self.bots[0].telegram_bot)
+    remember_chat_members(chat, {(parentfield, member)})
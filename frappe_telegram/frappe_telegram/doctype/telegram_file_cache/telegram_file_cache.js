@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Leam Technology Systems and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Telegram File Cache', {
+	// refresh: function(frm) {
+
+	// }
+});
@@ -0,0 +1,93 @@
+# Copyright (c) 2026, Leam Technology Systems and contributors
+# For license information, please see license.txt
+
+import os
+import hashlib
+
+import frappe
+from frappe.utils import now_datetime
+from frappe.model.document import Document
+from frappe_telegram.utils.cache import TTLCache
+
+"""
+Telegram returns a file_id for every uploaded file, which the same bot can send again without
+uploading it. File ids are recorded here against the md5 of the file's content, so that a file
+that changes on disk gets a new hash, and is uploaded afresh.
+Hashes of files on disk are memoized in-process by their path, size & mtime.
+"""
+HASH_CHUNK_SIZE = 1024 * 1024
+
+file_hash_cache = TTLCache(maxsize=1024, ttl=3600)
+
+
+class TelegramFileCache(Document):
+    pass
+
+
+def on_doctype_update():
+    # A single file_id per content of each bot, however many processes upload it at once
+    frappe.db.add_unique("Telegram File Cache", ["telegram_bot", "content_hash"])
+
+
+def get_cached_file_id(telegram_bot: str, content_hash: str) -> str:
+    return frappe.db.get_value(
+        "Telegram File Cache", {"telegram_bot": telegram_bot, "content_hash": content_hash},
+        "file_id")
+
+
+def set_cached_file_id(telegram_bot: str, content_hash: str, file_id: str, file_name=None):
+    """
+    Records the file_id, replacing the one recorded for the same content & bot if any
+    """
+    timestamp = now_datetime()
+    frappe.db.sql(
+        """
+        INSERT INTO `tabTelegram File Cache`
+            (name, creation, modified, owner, modified_by, docstatus, idx,
+             telegram_bot, content_hash, file_id, file_name)
+        VALUES (%(name)s, %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, 0, 0,
+             %(telegram_bot)s, %(content_hash)s, %(file_id)s, %(file_name)s)
+        ON DUPLICATE KEY UPDATE
+            file_id=VALUES(file_id), file_name=VALUES(file_name), modified=VALUES(modified),
+            modified_by=VALUES(modified_by)
+        """,
+        dict(
+            name=frappe.generate_hash("Telegram File Cache", 10), timestamp=timestamp,
+            user=frappe.session.user, telegram_bot=telegram_bot, content_hash=content_hash,
+            file_id=file_id, file_name=file_name))
+
+
+def clear_cached_file_id(telegram_bot: str, content_hash: str = None):
+    """
+    Clears the file_id recorded for the content, or every file_id of the bot
+    """
+    filters = {"telegram_bot": telegram_bot}
+    if content_hash:
+        filters["content_hash"] = content_hash
+
+    frappe.db.delete("Telegram File Cache", filters)
+
+
+def get_content_hash(content) -> str:
+    """
+    content: (`bytes` | `str`)
+        Either the content itself, or the path of a file on disk
+    """
+    if isinstance(content, bytes):
+        return hashlib.md5(content).hexdigest()
+
+    stat = os.stat(content)
+    key = (content, stat.st_size, stat.st_mtime_ns)
+    content_hash = file_hash_cache.get(key)
+    if content_hash:
+        return content_hash
+
+    md5 = hashlib.md5()
+    with open(content, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            md5.update(chunk)
+
+    content_hash = md5.hexdigest()
+    file_hash_cache.set(key, content_hash)
+
+    return content_hash
@@ -0,0 +1,91 @@
+# Copyright (c) 2026, Leam Technology Systems and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import MagicMock
+
+import frappe
+from telegram.error import BadRequest
+from frappe_telegram.client import send_document_cached
+from frappe_telegram.frappe_telegram.doctype.telegram_file_cache.telegram_file_cache import (
+    get_cached_file_id, set_cached_file_id, clear_cached_file_id, get_content_hash)
+
+TEST_BOT = "_Test File Cache Bot"
+
+
+class TestTelegramFileCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Inserting a Telegram Bot validates its api_token with Telegram
+        if not frappe.db.exists("Telegram Bot", TEST_BOT):
+            frappe.get_doc(dict(
+                doctype="Telegram Bot", name=TEST_BOT, title=TEST_BOT,
+                api_token="_test_api_token")).db_insert()
+
+    @classmethod
+    def tearDownClass(cls):
+        clear_cached_file_id(TEST_BOT)
+        frappe.db.delete("Telegram Bot", {"name": TEST_BOT})
+
+    def tearDown(self):
+        clear_cached_file_id(TEST_BOT)
+
+    def test_cached_file_id(self):
+        content_hash = get_content_hash(b"test content")
+        self.assertIsNone(get_cached_file_id(TEST_BOT, content_hash))
+
+        set_cached_file_id(TEST_BOT, content_hash, "file_id_1", file_name="test.txt")
+        self.assertEqual(get_cached_file_id(TEST_BOT, content_hash), "file_id_1")
+
+        # Replaced, not duplicated
+        set_cached_file_id(TEST_BOT, content_hash, "file_id_2")
+        self.assertEqual(get_cached_file_id(TEST_BOT, content_hash), "file_id_2")
+        self.assertEqual(frappe.db.count("Telegram File Cache", {"telegram_bot": TEST_BOT}), 1)
+
+        clear_cached_file_id(TEST_BOT, content_hash)
+        self.assertIsNone(get_cached_file_id(TEST_BOT, content_hash))
+
+    def test_send_document_cached(self):
+        content = b"test content"
+        bot = MagicMock()
+        bot.send_document.return_value.effective_attachment.file_id = "file_id_1"
+
+        send_document_cached(bot, 1, content, telegram_bot=TEST_BOT)
+        self.assertEqual(bot.send_document.call_args.kwargs["document"], content)
+        self.assertEqual(get_cached_file_id(TEST_BOT, get_content_hash(content)), "file_id_1")
+
+        # Sent again by its file_id
+        send_document_cached(bot, 1, content, telegram_bot=TEST_BOT)
+        self.assertEqual(bot.send_document.call_args.kwargs["document"], "file_id_1")
+
+    def test_send_document_cached_unknown_file_id(self):
+        "A file_id Telegram doesn't know anymore is replaced by a new upload"
+        content = b"test content"
+        content_hash = get_content_hash(content)
+        set_cached_file_id(TEST_BOT, content_hash, "stale_file_id")
+
+        uploaded = MagicMock()
+        uploaded.effective_attachment.file_id = "file_id_1"
+        bot = MagicMock()
+        bot.send_document.side_effect = [
+            BadRequest("Bad Request: wrong file identifier/http url specified"), uploaded]
+
+        self.assertEqual(send_document_cached(bot, 1, content, telegram_bot=TEST_BOT), uploaded)
+        self.assertEqual(bot.send_document.call_count, 2)
+        self.assertEqual(bot.send_document.call_args.kwargs["document"], content)
+        self.assertEqual(get_cached_file_id(TEST_BOT, content_hash), "file_id_1")
+
+    def test_send_document_cached_other_errors(self):
+        "Other BadRequests are raised, and keep the file_id"
+        content = b"test content"
+        content_hash = get_content_hash(content)
+        set_cached_file_id(TEST_BOT, content_hash, "file_id_1")
+
+        bot = MagicMock()
+        bot.send_document.side_effect = BadRequest("Bad Request: chat not found")
+
+        with self.assertRaises(BadRequest):
+            send_document_cached(bot, 1, content, telegram_bot=TEST_BOT)
+        self.assertEqual(bot.send_document.call_count, 1)
+        self.assertEqual(get_cached_file_id(TEST_BOT, content_hash), "file_id_1")
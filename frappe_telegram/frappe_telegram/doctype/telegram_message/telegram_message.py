@@ -11,12 +11,21 @@ class TelegramMessage(Document):
         self.update_last_message_on()
 
     def mark_as_password(self):
-        self.db_set("content", "*" * len(self.content))
+        from frappe_telegram.utils.message_buffer import get_message_buffer
+
+        self.content = "*" * len(self.content)
+        if getattr(self, "_realtime_message", None):
+            self._realtime_message["content"] = self.content
+        buffer = get_message_buffer()
+        if not buffer or not buffer.update(self.name, content=self.content):
+            self.db_set("content", self.content)
         if not getattr(frappe.flags, "in_telegram_update", None):
             return
 
         # Let's delete the message from the User's Chat
-        chat = frappe.get_doc("Telegram Chat", self.chat)
+        from frappe_telegram.frappe_telegram.doctype.telegram_chat.telegram_chat import (
+            get_telegram_chat_by_id)
+        chat = get_telegram_chat_by_id(self.chat)
         bot: Bot = chat.get_bot()
         try:
             bot.delete_message(chat_id=chat.chat_id, message_id=self.message_id)
@@ -26,7 +35,29 @@ class TelegramMessage(Document):
             pass
 
     def update_last_message_on(self):
-        chat = frappe.get_doc("Telegram Chat", self.chat)
-        chat.last_message_on = self.creation
-        chat.last_message_content = self.content
-        chat.save(ignore_permissions=True, ignore_version=True)
+        from frappe_telegram.utils.chat_activity import update_last_message, REALTIME_FIELDS
+        # Kept by reference until pushed, so that mark_as_password can mask it too
+        self._realtime_message = {field: self.get(field) for field in REALTIME_FIELDS}
+        update_last_message(
+            self.chat, self.creation, self.content, messages=[self._realtime_message])
+
+
+CONTENT_FULLTEXT_INDEX = "content_fulltext"
+
+
+def on_doctype_update():
+    # Keyset pagination of a chat's messages in the Telegram Chat View
+    frappe.db.add_index("Telegram Message", ["chat", "creation", "name"])
+
+    add_content_fulltext_index()
+
+
+def add_content_fulltext_index():
+    """
+    Message search; InnoDB keeps the index up to date on every insert
+    """
+    if frappe.db.db_type == "mariadb" and \
+            not frappe.db.has_index("tabTelegram Message", CONTENT_FULLTEXT_INDEX):
+        frappe.db.sql_ddl(
+            "ALTER TABLE `tabTelegram Message` ADD FULLTEXT INDEX `{}` (content)".format(
+                CONTENT_FULLTEXT_INDEX))
@@ -1,9 +1,84 @@
 # Copyright (c) 2021, Leam Technology Systems and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
+from frappe import _
 from frappe.model.document import Document
+from frappe_telegram.utils.cache import TTLCache
+
+"""
+Notifications render the same few templates over and over. Templates are compiled to Jinja code
+once, and cached in-process per (site, template, lang). Every render binds the code to the
+current Jinja environment, so that globals added since (eg: by jinja hooks) are available.
+Every save / delete of a Telegram Message Template bumps its version in redis, so that all
+processes (web, RQ workers, bots) recompile it on their next render.
+"""
+TEMPLATE_VERSION_KEY = "telegram_message_template_version"
+
+# (site, template): (version, {lang: compiled code})
+compiled_template_cache = TTLCache(maxsize=1024, ttl=3600)
 
 
 class TelegramMessageTemplate(Document):
-    pass
+    def on_update(self):
+        self.clear_compiled_template_cache()
+
+    def on_trash(self):
+        self.clear_compiled_template_cache()
+
+    def clear_compiled_template_cache(self):
+        frappe.cache().hset(TEMPLATE_VERSION_KEY, self.name, frappe.generate_hash(length=10))
+        compiled_template_cache.pop((frappe.local.site, self.name))
+
+
+def get_compiled_template(template: str, lang: str = None):
+    """
+    Returns the Jinja template of the Telegram Message Template in the given language,
+    falling back to its default_template
+    """
+    from frappe.utils.jinja import get_jenv
+
+    key = (frappe.local.site, template)
+    version = frappe.cache().hget(TEMPLATE_VERSION_KEY, template)
+    entry = compiled_template_cache.get(key)
+    if not entry or entry[0] != version:
+        entry = (version, {})
+
+    code = entry[1].get(lang)
+    if code is None:
+        code = compile_template(get_template_source(template, lang))
+        # Cached dicts are shared across threads; they are replaced, never updated
+        compiled_template_cache.set(key, (version, {**entry[1], lang: code}))
+
+    jenv = get_jenv()
+    return jenv.template_class.from_code(jenv, code, jenv.make_globals(None))
+
+
+def get_template_source(template: str, lang: str = None) -> str:
+    dt = "Telegram Message Template"
+    if not frappe.db.exists(dt, template):
+        frappe.throw(_("No template with name '{0}' exists.").format(template))
+
+    source = None
+    if lang:
+        source = frappe.db.get_value(
+            "Telegram Message Template Translation",
+            {"parent": template, "parenttype": dt, "language": lang}, "template")
+
+    if not source:
+        source = frappe.db.get_value(dt, template, "default_template")
+
+    return source or ""
+
+
+def compile_template(source: str):
+    """
+    Returns the compiled code of the template source
+    """
+    from frappe.utils.jinja import get_jenv
+
+    # Same guard as frappe.render_template
+    if ".__" in source:
+        frappe.throw(_("Illegal template"))
+
+    return get_jenv().compile(source)
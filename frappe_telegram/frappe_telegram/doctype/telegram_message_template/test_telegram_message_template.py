@@ -1,12 +1,15 @@
 # Copyright (c) 2021, Leam Technology Systems and Contributors
 # See license.txt
 
+import time
 import unittest
 from re import template
+from unittest.mock import patch
 
 import frappe
 from frappe.exceptions import ValidationError
-from frappe_telegram.client import send_message_from_template
+from frappe.utils.jinja import render_template
+from frappe_telegram.client import send_message_from_template, render_message_from_template
 from frappe_telegram.frappe_telegram.doctype.telegram_user.test_telegram_user import \
     TelegramUserFixtures
 from frappe_telegram.utils.test_fixture import TestFixture
@@ -93,3 +96,70 @@ class TestTelegramMessageTemplate(unittest.TestCase):
         #     templates[1].template_translations[0].language,
         #     telegram_user=self.templates.get_dependencies("Telegram User")[0].name
         # )
+
+    def test_render_message_from_template(self):
+        templates = self.templates.fixtures.get("Telegram Message Template")
+
+        self.assertEqual(
+            render_message_from_template(templates[1].name, {"test": "1"}),
+            "This is a test template 1")
+        self.assertEqual(
+            render_message_from_template(templates[1].name, {"test": "1"}, lang="ja"),
+            "This is the translation 1")
+        self.assertEqual(
+            render_message_from_template(templates[1].name, {"test": "1"}, lang="randomlang"),
+            "This is a test template 1")
+
+        # Compiled templates are recompiled once the template changes
+        templates[1].template_translations[0].template = "Updated translation {{test}}"
+        templates[1].save()
+        self.assertEqual(
+            render_message_from_template(templates[1].name, {"test": "1"}, lang="ja"),
+            "Updated translation 1")
+
+    def test_compiled_template_cache(self):
+        "Templates are compiled once per language, and again only once changed"
+        from frappe_telegram.frappe_telegram.doctype.telegram_message_template import \
+            telegram_message_template
+
+        template = self.templates.fixtures.get("Telegram Message Template")[1]
+        with patch.object(
+                telegram_message_template, "compile_template",
+                wraps=telegram_message_template.compile_template) as compile_template:
+            for i in range(3):
+                self.assertEqual(
+                    render_message_from_template(template.name, {"test": i}, lang="ja"),
+                    f"This is the translation {i}")
+            self.assertEqual(compile_template.call_count, 1)
+
+            render_message_from_template(template.name, {"test": 1})
+            self.assertEqual(compile_template.call_count, 2)
+
+            template.template_translations[0].template = "Updated translation {{test}}"
+            template.save()
+            self.assertEqual(
+                render_message_from_template(template.name, {"test": 1}, lang="ja"),
+                "Updated translation 1")
+            self.assertEqual(compile_template.call_count, 3)
+
+    def test_render_message_from_template_benchmark(self):
+        "Reports a cached render against loading & parsing the template on every render"
+        template = self.templates.fixtures.get("Telegram Message Template")[1]
+        runs = 1000
+
+        started_on = time.perf_counter()
+        for i in range(runs):
+            doc = frappe.get_doc("Telegram Message Template", template.name)
+            source = [x.template for x in doc.template_translations if x.language == "ja"][0]
+            render_template(source, {"test": i})
+        uncached = time.perf_counter() - started_on
+
+        started_on = time.perf_counter()
+        for i in range(runs):
+            render_message_from_template(template.name, {"test": i}, lang="ja")
+        cached = time.perf_counter() - started_on
+
+        # Timings vary too much across machines to assert on; test_compiled_template_cache
+        # covers the cache itself
+        print("render_message_from_template x{}: uncached {:.3f}s, cached {:.3f}s".format(
+            runs, uncached, cached))
@@ -1,8 +1,107 @@
 # Copyright (c) 2021, Leam Technology Systems and contributors
 # For license information, please see license.txt
 
-# import frappe
+from typing import NamedTuple, Optional
+
+import frappe
 from frappe.model.document import Document
+from frappe_telegram.utils.cache import TTLCache
+
+"""
+Every Update needs the Telegram User of its sender, along with the frappe User linked to it.
+Resolved Telegram Users are cached in-process by their telegram_user_id, as read-only snapshots
+that can be shared across threads.
+Every change to an existing Telegram User, from any process (eg: Desk), bumps a version kept in
+redis. Entries cached under an older version are dropped on their next lookup.
+"""
+telegram_user_cache = TTLCache(maxsize=10000, ttl=60)
+
+CACHE_VERSION_KEY = "telegram_user_cache_version"
+
+
+class TelegramUserSnapshot(NamedTuple):
+    name: str
+    telegram_user_id: str
+    user: Optional[str]
+    is_guest: int
+    full_name: str
+    telegram_username: Optional[str]
+
+    def get_doc(self) -> "TelegramUser":
+        return frappe.get_doc("Telegram User", self.name)
+
 
 class TelegramUser(Document):
-	pass
+    def on_change(self):
+        # Also run by db_set
+        self.clear_telegram_user_cache()
+
+    def on_trash(self):
+        self.clear_telegram_user_cache()
+
+    def clear_telegram_user_cache(self):
+        telegram_user_cache.pop(str(self.telegram_user_id))
+
+        previous = self.get_doc_before_save()
+        if previous:
+            telegram_user_cache.pop(str(previous.telegram_user_id))
+
+        if not self.flags.in_insert:
+            # Misses aren't cached; a new Telegram User invalidates nothing
+            bump_cache_version()
+
+    def get_snapshot(self) -> TelegramUserSnapshot:
+        return TelegramUserSnapshot(
+            **{field: self.get(field) for field in TelegramUserSnapshot._fields})
+
+
+def clear_telegram_user_cache(telegram_user_id):
+    """
+    For changes made without the Telegram User document, eg: frappe.db.set_value
+    """
+    telegram_user_cache.pop(str(telegram_user_id))
+    bump_cache_version()
+
+
+def bump_cache_version():
+    redis = frappe.cache()
+    redis.incr(redis.make_key(CACHE_VERSION_KEY))
+
+
+def get_cache_version() -> Optional[int]:
+    """
+    Returns None when redis can't be reached, in which case nothing is read from the cache
+    """
+    redis = frappe.cache()
+    try:
+        return int(redis.get(redis.make_key(CACHE_VERSION_KEY)) or 0)
+    except Exception:
+        return None
+
+
+def cache_telegram_user(telegram_user: TelegramUser, version: int = None):
+    if version is None:
+        version = get_cache_version()
+    if version is not None:
+        telegram_user_cache.set(
+            str(telegram_user.telegram_user_id), (version, telegram_user.get_snapshot()))
+
+
+def get_telegram_user_by_id(telegram_user_id) -> Optional[TelegramUserSnapshot]:
+    """
+    Returns the Telegram User with the given telegram_user_id, or None if there is none yet
+    """
+    telegram_user_id = str(telegram_user_id)
+    version = get_cache_version()
+    cached = telegram_user_cache.get(telegram_user_id)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+
+    name = frappe.db.get_value("Telegram User", {"telegram_user_id": telegram_user_id})
+    if not name:
+        return None
+
+    telegram_user = frappe.get_doc("Telegram User", name)
+    cache_telegram_user(telegram_user, version)
+
+    return telegram_user.get_snapshot()
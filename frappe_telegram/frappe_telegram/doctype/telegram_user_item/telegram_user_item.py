@@ -1,8 +1,13 @@
 # Copyright (c) 2021, Leam Technology Systems and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 class TelegramUserItem(Document):
 	pass
+
+
+def on_doctype_update():
+	# Membership lookups of a user within a chat; also keeps concurrent inserts from duplicating it
+	frappe.db.add_unique("Telegram User Item", ["parent", "parentfield", "telegram_user"])
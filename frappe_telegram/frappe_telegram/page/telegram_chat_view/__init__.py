@@ -1,4 +1,7 @@
+import re
+
 import frappe
+from frappe.utils import add_days, cint, getdate
 
 
 @frappe.whitelist()
@@ -21,30 +24,124 @@ def get_telegram_chat(chat_type, user=None, group=None):
 
 
 @frappe.whitelist()
-def load_chat_rooms(limit_start, limit_page_length):
+def load_chat_rooms(limit_page_length=20, before_last_message_on=None, before_name=None):
+    """
+    Pages through the chats, latest first. Pass the last_message_on & name of the last chat
+    loaded to get the next page. Each page is a range scan on the (last_message_on, name) index,
+    however deep it is
+    """
+    conditions = ""
+    if before_name:
+        if before_last_message_on:
+            conditions = """
+            WHERE last_message_on < %(last_message_on)s
+                OR (last_message_on = %(last_message_on)s AND name < %(name)s)
+                OR last_message_on IS NULL
+            """
+        else:
+            # Chats without messages sort last
+            conditions = "WHERE last_message_on IS NULL AND name < %(name)s"
+
     return frappe.db.sql(
         f"""
         SELECT
-            chat_id, title, type, last_message_on, last_message_content
+            name, chat_id, title, type, last_message_on, last_message_content
+        FROM `tabTelegram Chat`
+        {conditions}
+        ORDER BY last_message_on DESC, name DESC
+        LIMIT {cint(limit_page_length)}
+        """,
+        {"last_message_on": before_last_message_on, "name": before_name},
+        as_dict=1
+    )
+
+
+@frappe.whitelist()
+def load_chat_room(chat_id):
+    return frappe.db.sql(
+        """
+        SELECT
+            name, chat_id, title, type, last_message_on, last_message_content
         FROM `tabTelegram Chat`
-        ORDER BY last_message_on DESC
-        LIMIT {limit_start}, {limit_page_length}
+        WHERE name=%(chat)s
         """,
+        {"chat": chat_id},
         as_dict=1
     )
 
 
 @frappe.whitelist()
-def load_chat_messages(chat_id, limit_start, limit_page_length):
-    return reversed(frappe.db.sql(
+def load_chat_messages(chat_id, limit_page_length=20, before_creation=None, before_name=None):
+    """
+    Pages through the messages of a chat, latest first; each page is returned oldest first.
+    Pass the creation & name of the oldest message loaded to get the previous page. Each page is
+    a range scan on the (chat, creation, name) index, however deep it is
+    """
+    conditions = ""
+    if before_creation and before_name:
+        conditions = """
+            AND (creation < %(creation)s OR (creation = %(creation)s AND name < %(name)s))
+        """
+
+    return list(reversed(frappe.db.sql(
         f"""
             SELECT
                 name, content, from_user, from_bot, message_id, creation
             FROM `tabTelegram Message`
-            WHERE chat=%(chat)s
-            ORDER BY modified DESC
-            LIMIT {limit_start}, {limit_page_length}
+            WHERE chat=%(chat)s {conditions}
+            ORDER BY creation DESC, name DESC
+            LIMIT {cint(limit_page_length)}
         """,
-        {"chat": chat_id},
+        {"chat": chat_id, "creation": before_creation, "name": before_name},
         as_dict=1
-    ))
+    )))
+
+
+@frappe.whitelist()
+def search_chat_messages(query, chat_id=None, from_date=None, to_date=None, limit_page_length=20):
+    """
+    Searches the content of Telegram Messages, best matches first.
+    Uses the FULLTEXT index on content, where every word of the query has to match the start of
+    a word in the message. Optionally limited to a chat, and to messages from / to a date
+    """
+    frappe.has_permission("Telegram Message", throw=True)
+
+    words = re.findall(r"\w+", query or "", flags=re.UNICODE)
+    if not words:
+        return []
+
+    values = {"chat": chat_id, "from_date": from_date,
+              "to_date": add_days(getdate(to_date), 1) if to_date else None}
+    conditions = []
+    if chat_id:
+        conditions.append("m.chat = %(chat)s")
+    if from_date:
+        conditions.append("m.creation >= %(from_date)s")
+    if to_date:
+        conditions.append("m.creation < %(to_date)s")
+
+    if frappe.db.db_type == "mariadb":
+        values["query"] = " ".join(f"+{word}*" for word in words)
+        score = "MATCH(m.content) AGAINST (%(query)s IN BOOLEAN MODE)"
+        conditions.append(score)
+    else:
+        # No FULLTEXT index; fall back to a scan
+        score = "1"
+        for i, word in enumerate(words):
+            values[f"word_{i}"] = f"%{word}%"
+            conditions.append(f"m.content ILIKE %(word_{i})s")
+
+    return frappe.db.sql(
+        f"""
+        SELECT
+            m.name, m.chat, c.title AS chat_title, m.content, m.from_user, m.from_bot,
+            m.message_id, m.creation, {score} AS score
+        FROM `tabTelegram Message` m
+        LEFT JOIN `tabTelegram Chat` c ON c.name = m.chat
+        WHERE {" AND ".join(conditions)}
+        ORDER BY score DESC, m.creation DESC
+        LIMIT {cint(limit_page_length)}
+        """,
+        values,
+        as_dict=1
+    )
@@ -8,13 +8,11 @@ frappe.pages["telegram-chat-view"].on_page_load = function (wrapper) {
 
 class TelegramChatView {
 	chat_list = [];
-	chat_list_offset = 0
 	chat_list_limit_length = 20
 	chat_list_has_more = true
 
 	currentChat = null
 	chat_messages = []
-	chat_message_offset = 0
 	chat_message_limit_length = 20
 	chat_message_has_more = true
 
@@ -25,38 +23,135 @@ class TelegramChatView {
 			single_column: true,
 		});
 		this.content = $(this.page.body);
+		this.setupRealtime();
+	}
+
+	setupRealtime() {
+		// New messages of the open chat; bursts arrive as a single push
+		frappe.realtime.on("telegram_chat_messages", (data) => {
+			if (!this.currentChat || data.chat != this.currentChat.name || !this.messagesContainer) {
+				return;
+			}
+			const known = new Set(this.chat_messages.map(x => x.name));
+			const messages = data.messages.filter(x => !known.has(x.name));
+			if (!messages.length) {
+				return;
+			}
+
+			const container = this.messagesContainer[0];
+			const atBottom = container.scrollHeight - container.scrollTop - container.clientHeight < 50;
+			this.chat_messages.push(...messages);
+			this.renderChatMessages();
+			if (atBottom) {
+				this.messagesContainer.scrollTop(container.scrollHeight);
+			}
+		});
+
+		// Last messages of chats, to reorder the chat list
+		frappe.realtime.on("telegram_chat_list_update", (data) => {
+			for (const update of data.chats) {
+				const index = this.chat_list.findIndex(x => x.name == update.name);
+				if (index < 0) {
+					continue;
+				}
+				const [chat] = this.chat_list.splice(index, 1);
+				Object.assign(chat, update);
+				this.chat_list.unshift(chat);
+			}
+			if (!this.currentChat) {
+				this.renderChatList();
+			}
+		});
+		frappe.socketio.doctype_subscribe("Telegram Chat");
 	}
 
 	async showChatList() {
+		this.leaveChat();
 		this.clearPage();
+		this.chat_list = [];
 		await this.loadChatList()
+		this.renderChatList();
+	}
+
+	renderChatList() {
+		$(this.chat_list_wrapper).remove();
 		this.chat_list_wrapper = $(frappe.render_template("chat_list", {
-			chat_list: this.chat_list
+			chat_list: this.chat_list,
+			has_more: this.chat_list_has_more
 		})).appendTo(this.content)
 		$(this.chat_list_wrapper).find(".chat-room").click((e) => {
 			this.openChat($(e.currentTarget).data("chatId"));
 		})
+		$(this.chat_list_wrapper).find(".load-more").click(async () => {
+			await this.loadChatList();
+			this.renderChatList();
+		})
+		$(this.chat_list_wrapper).find(".chat-search")
+			.val(this.search_query || "")
+			.on("input", frappe.utils.debounce((e) => this.searchMessages($(e.target).val()), 300));
+		if (this.search_query) {
+			this.searchMessages(this.search_query);
+		}
+	}
+
+	async searchMessages(query) {
+		this.search_query = query;
+		const resultsWrapper = $(this.chat_list_wrapper).find(".chat-search-results");
+		const chatRooms = $(this.chat_list_wrapper).find(".chat-room, .load-more");
+		if (!query.trim()) {
+			resultsWrapper.empty();
+			chatRooms.show();
+			return;
+		}
+
+		const r = await frappe.xcall(
+			"frappe_telegram.frappe_telegram.page.telegram_chat_view.search_chat_messages", {
+			query: query
+		}).catch(r => [])
+		if (query != this.search_query) {
+			// A newer search is under way
+			return;
+		}
+
+		chatRooms.hide();
+		resultsWrapper.html(frappe.render_template("chat_search_results", { results: r }));
+		resultsWrapper.find(".chat-search-result").click(async (e) => {
+			const chat_id = $(e.currentTarget).data("chatId");
+			if (!this.chat_list.find(x => x.chat_id == chat_id)) {
+				this.chat_list.push(...await frappe.xcall(
+					"frappe_telegram.frappe_telegram.page.telegram_chat_view.load_chat_room", {
+					chat_id: chat_id
+				}))
+			}
+			this.openChat(chat_id);
+		})
 	}
 
 	async loadChatList() {
+		// Cursor: the last chat loaded so far
+		const last = this.chat_list[this.chat_list.length - 1];
 		const r = await frappe.xcall(
 			"frappe_telegram.frappe_telegram.page.telegram_chat_view.load_chat_rooms", {
-			limit_start: this.chat_list_offset,
-			limit_page_length: this.chat_list_limit_length
+			limit_page_length: this.chat_list_limit_length,
+			before_last_message_on: last ? last.last_message_on : null,
+			before_name: last ? last.name : null
 		}).catch(r => [])
 		this.chat_list.push(...r);
-		this.chat_list_offset += this.chat_list_limit_length
+		this.chat_list_has_more = r.length == this.chat_list_limit_length;
 	}
 
 	async loadChatMessages() {
+		// Cursor: the oldest message loaded so far
+		const oldest = this.chat_messages[0];
 		const r = await frappe.xcall(
 			"frappe_telegram.frappe_telegram.page.telegram_chat_view.load_chat_messages", {
 			chat_id: this.currentChat.chat_id,
-			limit_start: this.chat_message_offset,
-			limit_page_length: this.chat_message_limit_length
+			limit_page_length: this.chat_message_limit_length,
+			before_creation: oldest ? oldest.creation : null,
+			before_name: oldest ? oldest.name : null
 		}).catch(r => [])
-		this.chat_messages.push(...r);
-		this.chat_message_offset += this.chat_message_limit_length;
+		this.chat_messages.unshift(...r);
+		this.chat_message_has_more = r.length == this.chat_message_limit_length;
 		return r;
 	}
 
@@ -64,16 +159,47 @@ class TelegramChatView {
 		$(this.content).empty();
 	}
 
+	leaveChat() {
+		if (this.currentChat) {
+			frappe.socketio.doc_unsubscribe("Telegram Chat", this.currentChat.name);
+		}
+		this.currentChat = null;
+		this.messagesContainer = null;
+	}
+
 	async openChat(chat_id) {
-		this.chat_message_offset = 0;
+		this.leaveChat();
 		this.currentChat = this.chat_list.find(x => x.chat_id == chat_id)
+		frappe.socketio.doc_subscribe("Telegram Chat", this.currentChat.name);
 		this.chat_messages = []
+		this.chat_message_has_more = true
 		this.clearPage();
 
 		await this.loadChatMessages()
-		// debugger
 		this.currentChatView = $(frappe.render_template("chat_view", { chat: this.currentChat })).appendTo(this.content);
-		const messagesContainer = $(this.currentChatView).find(".chat-messages")
+		this.messagesContainer = $(this.currentChatView).find(".chat-messages")
+		this.renderChatMessages();
+		this.messagesContainer.scrollTop(this.messagesContainer[0].scrollHeight);
+
+		// Load older messages on scrolling to the top
+		this.messagesContainer.on("scroll", async () => {
+			if (this.messagesContainer.scrollTop() > 0 || !this.chat_message_has_more || this.loading_messages) {
+				return;
+			}
+			this.loading_messages = true;
+			const scrollHeight = this.messagesContainer[0].scrollHeight;
+			const r = await this.loadChatMessages();
+			if (r.length) {
+				this.renderChatMessages();
+				this.messagesContainer.scrollTop(this.messagesContainer[0].scrollHeight - scrollHeight);
+			}
+			this.loading_messages = false;
+		})
+	}
+
+	renderChatMessages() {
+		const messagesContainer = this.messagesContainer;
+		messagesContainer.empty();
 
 		let date = null;
 		for (const msg of this.chat_messages) {
@@ -1,5 +1,7 @@
 import frappe
 from frappe_telegram import Update, CallbackContext, Updater, MessageHandler
+from frappe_telegram.frappe_telegram.doctype.telegram_user.telegram_user import (
+    get_telegram_user_by_id)
 from .credentials import login_handler, attach_conversation_handler
 
 AUTH_HANDLER_GROUP = -100
@@ -16,7 +18,7 @@ def authenticate(update: Update, context: CallbackContext):
     #     raise DispatcherHandlerStop()
 
     user = update.effective_user
-    telegram_user = frappe.db.get_value("Telegram User", {"telegram_user_id": user.id}, "*")
+    telegram_user = get_telegram_user_by_id(user.id)
 
     if telegram_user and telegram_user.user:
         # update.effective_message.reply_text("Logged in as " + telegram_user.user)
@@ -1,14 +1,25 @@
 from typing import Union
 import frappe
 from frappe_telegram import Update, CallbackContext, Message
+from frappe_telegram.utils.message_buffer import get_message_buffer
+from frappe_telegram.utils.snapshot import LazyDocument
+from frappe_telegram.frappe_telegram.doctype.telegram_user.telegram_user import (
+    get_telegram_user_by_id, cache_telegram_user)
+from frappe_telegram.frappe_telegram.doctype.telegram_chat.telegram_chat import (
+    get_telegram_chat_by_id, add_chat_member)
 
 
 def handler(update: Update, context: CallbackContext):
     if not hasattr(update, "effective_user"):
         return
     context.telegram_bot = frappe.get_cached_doc("Telegram Bot", context.bot.telegram_bot)
-    context.telegram_user = get_telegram_user(update)
-    context.telegram_chat = get_telegram_chat(update, context)
+    # Read-only; context.telegram_user is the Telegram User Document, loaded only when needed
+    context.telegram_user_snapshot = get_telegram_user(update)
+    context.telegram_user = LazyDocument(context.telegram_user_snapshot) \
+        if context.telegram_user_snapshot else None
+    context.telegram_chat_snapshot = get_telegram_chat(update, context)
+    context.telegram_chat = LazyDocument(context.telegram_chat_snapshot) \
+        if context.telegram_chat_snapshot else None
     if context.telegram_chat and context.telegram_user:
         context.telegram_message = get_telegram_message(
             update, context.telegram_chat, context.telegram_user)
@@ -25,19 +36,22 @@ def log_outgoing_message(telegram_bot: str, result: Union[bool, Message]):
     else:
         content = ""
 
+    buffer = get_message_buffer()
     msg = frappe.get_doc(
         doctype="Telegram Message",
-        chat=frappe.db.get_value("Telegram Chat", {"chat_id": result.chat_id}),
+        # Telegram Chats are named by their chat_id
+        chat=str(result.chat_id) if buffer else frappe.db.get_value(
+            "Telegram Chat", {"chat_id": result.chat_id}),
         message_id=result.message_id,
         content=content, from_bot=telegram_bot)
-    msg.insert(ignore_permissions=True)
+    insert_message(msg)
 
 
 def get_telegram_user(update: Update):
     telegram_user = update.effective_user
-    user = frappe.db.get_value("Telegram User", {"telegram_user_id": telegram_user.id})
+    user = get_telegram_user_by_id(telegram_user.id)
     if user:
-        return frappe.get_cached_doc("Telegram User", user)
+        return user
 
     full_name = telegram_user.first_name
     if telegram_user.last_name:
@@ -50,35 +64,26 @@ def get_telegram_user(update: Update):
         full_name=full_name.strip())
     user.insert(ignore_permissions=True)
     frappe.db.commit()
+    cache_telegram_user(user)
 
-    return user
+    return user.get_snapshot()
 
 
 def get_telegram_chat(update: Update, context: CallbackContext):
     """
     We cannot get all the ChatMembers at once via TelegramBot API
     We will have to add new members as we see messages from them.
+    The chat is returned as a snapshot without its users & bots tables,
+    see `get_telegram_chat_by_id`
     """
     if not update.effective_chat:
         return
 
     telegram_chat = update.effective_chat
-    chat = frappe.db.get_value("Telegram Chat", {"chat_id": telegram_chat.id})
+    chat = get_telegram_chat_by_id(telegram_chat.id)
     if chat:
-        chat = frappe.get_cached_doc("Telegram Chat", chat)
-
-        has_new_member = False
-        for x in (("bot", context.telegram_bot), ("user", context.telegram_user)):
-            table_df = f"{x[0]}s"
-            field_df = f"telegram_{x[0]}"
-            if chat.get(table_df, {field_df: x[1].name}):
-                continue
-            chat.append(table_df, {field_df: x[1].name})
-
-            has_new_member = True
-
-        if has_new_member:
-            chat.save(ignore_permissions=True)
+        add_chat_member(chat.name, "bots", context.telegram_bot.name)
+        add_chat_member(chat.name, "users", context.telegram_user.name)
 
     else:
         chat = frappe.get_doc(
@@ -90,6 +95,7 @@ def get_telegram_chat(update: Update, context: CallbackContext):
         chat.append("users", {"telegram_user": context.telegram_user.name})
 
         chat.insert(ignore_permissions=True)
+        chat = chat.get_snapshot()
 
     return chat
 
@@ -102,6 +108,15 @@ def get_telegram_message(update: Update, telegram_chat, telegram_user):
     msg = frappe.get_doc(
         doctype="Telegram Message", chat=telegram_chat.name, message_id=telegram_message.message_id,
         content=telegram_message.text, from_user=telegram_user.name)
-    msg.insert(ignore_permissions=True)
+    insert_message(msg)
 
     return msg
+
+
+def insert_message(msg):
+    """
+    Inserts the Telegram Message right away, or defers it to the buffer if buffered logging is on
+    """
+    buffer = get_message_buffer()
+    if not buffer or not buffer.add(msg):
+        msg.insert(ignore_permissions=True)
@@ -1,6 +1,8 @@
+import time
+
 import frappe
 from frappe.email.doctype.notification.notification import Notification, get_context
-from frappe_telegram.client import send_file, send_message
+from frappe_telegram.client import send_bulk, send_file_bulk, get_telegram_user_ids
 from frappe_telegram.frappe_telegram.doctype.telegram_bot import DEFAULT_TELEGRAM_BOT_KEY
 
 
@@ -11,6 +13,16 @@ Please do not forget to use the module function `send_telegram_notification` to
 Telegram Notifications.
 """
 
+# Recipients covered by a single fan-out job. Can be overridden with
+# `telegram_notification_chunk_size` in site_config.json
+NOTIFICATION_CHUNK_SIZE = 100
+
+# Seconds the print attachment of a notification is kept in redis for its jobs
+PRINT_FILE_TTL = 6 * 60 * 60
+
+# Seconds a job may hold the upload of a print attachment, before others upload it themselves
+PRINT_UPLOAD_LOCK_TIMEOUT = 60
+
 
 class TelegramNotification(Notification):
     def send(self, doc):
@@ -49,35 +61,139 @@ def send_telegram_notification(notification, doc):
         attachment = notification.get_attachment(doc)[0]
         attachment.pop("print_format_attachment")
         print_file = frappe.attach_print(**attachment)
+        print_file = cache_print_file(print_file)
 
-    for user in users:
-        if not frappe.db.exists("Telegram User", {"user": user}):
-            continue
+    telegram_users = list(get_telegram_user_ids(users=users))
+    chunk_size = frappe.conf.get("telegram_notification_chunk_size") or NOTIFICATION_CHUNK_SIZE
 
+    for i in range(0, len(telegram_users), chunk_size):
         frappe.enqueue(
-            method=send_message,
+            method=send_notification_chunk,
             queue="short",
+            telegram_users=telegram_users[i:i + chunk_size],
             message_text=message_text,
-            user=user,
             from_bot=from_bot,
-            parse_mode="HTML",
+            print_file=print_file if notification.attach_print else None,
+            notification=notification.name,
             enqueue_after_commit=True
         )
 
-        if notification.attach_print:
-            frappe.enqueue(
-                method=send_file,
-                queue="short",
-                file=print_file.get("fcontent"),
-                filename=print_file.get("fname"),
-                user=user,
-                from_bot=from_bot,
-                enqueue_after_commit=True
-            )
+
+def send_notification_chunk(telegram_users, message_text, from_bot, print_file=None,
+                            notification=None):
+    """
+    Sends a notification to a chunk of its recipients, over a single bot connection.
+    Recipients that couldn't be sent to are recorded in the Error Log
+    """
+    failed = frappe._dict()
+
+    result = send_bulk(
+        message_text, telegram_users=telegram_users, parse_mode="HTML", from_bot=from_bot)
+    if result.failed:
+        failed.message = result.failed
+
+    if print_file:
+        send_print_file(print_file, telegram_users, from_bot, failed)
+
+    if failed:
+        frappe.log_error(
+            title="Telegram Notification Failed",
+            message=frappe.as_json(dict(notification=notification, failed=failed)))
+
+
+def send_print_file(print_file: dict, telegram_users: list, from_bot: str, failed: dict):
+    """
+    Chunk jobs run concurrently. The first of them to find no file_id uploads the print
+    attachment, to one recipient at a time until Telegram takes it, while the others wait for
+    the file_id it gets back
+    """
+    file_id, locked = get_print_file_id(print_file, from_bot)
+    remaining = list(telegram_users)
+    if not file_id:
+        try:
+            content = frappe.cache().get_value(print_file.get("key"))
+            if content is None:
+                failed.print_file = {x: "Print attachment expired" for x in telegram_users}
+                return
+
+            while remaining and not file_id:
+                result = send_file_bulk(
+                    content, filename=print_file.get("fname"), telegram_users=[remaining.pop(0)],
+                    from_bot=from_bot)
+                if result.failed:
+                    failed.setdefault("print_file", {}).update(result.failed)
+                file_id = result.file_id
+
+            if file_id:
+                frappe.cache().set_value(
+                    get_print_file_id_key(print_file, from_bot), file_id,
+                    expires_in_sec=PRINT_FILE_TTL)
+        finally:
+            if locked:
+                release_print_upload_lock(print_file, from_bot)
+
+    if remaining:
+        result = send_file_bulk(
+            file_id, filename=print_file.get("fname"), telegram_users=remaining,
+            from_bot=from_bot)
+        if result.failed:
+            failed.setdefault("print_file", {}).update(result.failed)
+
+
+def get_print_file_id(print_file: dict, from_bot: str):
+    """
+    Returns (file_id, locked):
+    - the Telegram file_id of the print attachment if a job already uploaded it
+    - else, whether this job now holds the upload lock. It doesn't if another job held it
+      for too long
+    """
+    file_id_key = get_print_file_id_key(print_file, from_bot)
+    lock_key = frappe.cache().make_key(f"{file_id_key}|upload")
+    deadline = time.monotonic() + PRINT_UPLOAD_LOCK_TIMEOUT
+
+    while True:
+        # Not from frappe.local.cache, where a miss would stick
+        file_id = frappe.cache().get_value(file_id_key, expires=True)
+        if file_id:
+            return file_id, False
+
+        if frappe.cache().set(lock_key, 1, ex=PRINT_UPLOAD_LOCK_TIMEOUT, nx=True):
+            return None, True
+
+        if time.monotonic() > deadline:
+            # Rather upload it once more than not at all
+            return None, False
+
+        time.sleep(0.5)
+
+
+def release_print_upload_lock(print_file: dict, from_bot: str):
+    frappe.cache().delete(
+        frappe.cache().make_key(f"{get_print_file_id_key(print_file, from_bot)}|upload"))
+
+
+def cache_print_file(print_file: dict) -> dict:
+    """
+    Keeps the print attachment in redis, so that the notification jobs carry only a reference.
+    Returns the reference
+    """
+    key = "telegram_notification_print|{}".format(frappe.generate_hash(length=12))
+    frappe.cache().set_value(key, print_file.get("fcontent"), expires_in_sec=PRINT_FILE_TTL)
+
+    return dict(key=key, fname=print_file.get("fname"))
+
+
+def get_print_file_id_key(print_file: dict, from_bot: str) -> str:
+    return "{}|{}".format(print_file.get("key"), from_bot)
 
 
 def get_recipients(notification, doc, context):
-    recipients = []
+    """
+    Collects the candidate users of all recipient rows first, and then resolves them in a
+    constant number of queries, however many recipients there are
+    """
+    candidates = []
+    roles = []
 
     for recipient in notification.recipients:
         if recipient.condition:
@@ -89,20 +205,24 @@ def get_recipients(notification, doc, context):
             # fields from child table
             if len(fields) > 1:
                 for d in doc.get(fields[1]):
-                    user = d.get(fields[0])
-                    if frappe.db.exists("User", user):
-                        recipients.append(user)
+                    candidates.append(d.get(fields[0]))
             # field from parent doc
             else:
-                user = doc.get(fields[0])
-                if frappe.db.exists("User", user):
-                    recipients.append(user)
+                candidates.append(doc.get(fields[0]))
 
         if recipient.receiver_by_role:
-            users = [x.parent for x in frappe.get_all(
-                "Has Role",
-                filters={"role": recipient.receiver_by_role, "parenttype": "User"},
-                fields=["parent"])]
-            recipients.extend(users)
+            roles.append(recipient.receiver_by_role)
+
+    recipients = set()
+    candidates = [x for x in candidates if x and isinstance(x, str)]
+    if candidates:
+        recipients.update(frappe.get_all(
+            "User", filters={"name": ["in", list(set(candidates))]}, pluck="name"))
+
+    if roles:
+        recipients.update(frappe.get_all(
+            "Has Role",
+            filters={"role": ["in", list(set(roles))], "parenttype": "User"},
+            pluck="parent"))
 
-    return list(set(recipients))
+    return list(recipients)
@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+    """
+    Keyset pagination of the Telegram Chat View. The doctypes are unchanged, so the model sync
+    doesn't add the indexes on existing sites
+    """
+    frappe.db.add_index("Telegram Chat", ["last_message_on", "name"])
+    frappe.db.add_index("Telegram Message", ["chat", "creation", "name"])
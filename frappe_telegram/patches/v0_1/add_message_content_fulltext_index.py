@@ -0,0 +1,10 @@
+from frappe_telegram.frappe_telegram.doctype.telegram_message.telegram_message import (
+    add_content_fulltext_index)
+
+
+def execute():
+    """
+    search_chat_messages needs the FULLTEXT index on content. Telegram Message is unchanged, so
+    the model sync doesn't add it on existing sites
+    """
+    add_content_fulltext_index()
@@ -0,0 +1,25 @@
+import frappe
+from frappe_telegram.frappe_telegram.doctype.telegram_user_item import telegram_user_item
+from frappe_telegram.frappe_telegram.doctype.telegram_bot_item import telegram_bot_item
+
+
+def execute():
+    """
+    Chat member tables get a unique index on (parent, parentfield, member); drop the rows that
+    concurrent inserts duplicated before it, and add it.
+    The doctypes are unchanged, so the model sync doesn't add it on existing sites
+    """
+    for doctype, fieldname in (
+            ("Telegram User Item", "telegram_user"), ("Telegram Bot Item", "telegram_bot")):
+        frappe.db.sql(f"""
+            DELETE duplicate FROM `tab{doctype}` duplicate
+            JOIN `tab{doctype}` original
+                ON original.parent = duplicate.parent
+                AND original.parentfield = duplicate.parentfield
+                AND original.{fieldname} = duplicate.{fieldname}
+                AND (original.idx < duplicate.idx
+                    OR (original.idx = duplicate.idx AND original.name < duplicate.name))
+        """)
+
+    telegram_user_item.on_doctype_update()
+    telegram_bot_item.on_doctype_update()
@@ -0,0 +1,71 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from frappe_telegram.bot import receive_webhook_update, get_webhook_rq_queue
+
+UPDATE = json.dumps(dict(update_id=1, message=dict(
+    message_id=1, date=0, chat=dict(id=1, type="private"), text="Hi")))
+
+
+class TestReceiveWebhookUpdate(unittest.TestCase):
+
+    def setUp(self):
+        # The api_token is checked against Telegram on insert
+        with patch("telegram.ext.ExtBot.get_me", return_value=frappe._dict(
+                is_bot=True, username="TestWebhookBot")):
+            self.telegram_bot = frappe.get_doc(frappe._dict(
+                doctype="Telegram Bot",
+                title="TestWebhookBot",
+                api_token="webhookapitoken",
+                receive_updates_on_site=1,
+            )).insert()
+        self.secret_token = self.telegram_bot.get_password("webhook_secret_token")
+
+    def tearDown(self):
+        frappe.delete_doc("Telegram Bot", self.telegram_bot.name, force=True)
+
+    def receive(self, telegram_bot: str, secret_token: str = None):
+        """
+        Posts UPDATE to the endpoint, and returns the mocked frappe.enqueue
+        """
+        headers = {}
+        if secret_token is not None:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = secret_token
+        request = SimpleNamespace(get_data=lambda as_text=False: UPDATE)
+
+        with patch.object(frappe, "get_request_header",
+                          side_effect=lambda key, default=None: headers.get(key, default)), \
+                patch.object(frappe, "request", request), \
+                patch.object(frappe, "enqueue") as enqueue:
+            receive_webhook_update(telegram_bot)
+
+        return enqueue
+
+    def test_enqueue(self):
+        enqueue = self.receive(self.telegram_bot.name, self.secret_token)
+        enqueue.assert_called_once_with(
+            "frappe_telegram.bot.process_webhook_update",
+            queue=get_webhook_rq_queue(),
+            telegram_bot=self.telegram_bot.name,
+            update=UPDATE)
+
+    def test_wrong_or_missing_secret_token(self):
+        for secret_token in ("wrong", "", None):
+            self.assertRaises(
+                frappe.PermissionError, self.receive, self.telegram_bot.name, secret_token)
+
+    def test_unknown_bot(self):
+        self.assertRaises(
+            frappe.PermissionError, self.receive, "UnknownWebhookBot", self.secret_token)
+
+    def test_bot_not_receiving_updates_on_site(self):
+        # Caches the secret token in this process
+        self.receive(self.telegram_bot.name, self.secret_token)
+
+        self.telegram_bot.receive_updates_on_site = 0
+        self.telegram_bot.save()
+        self.assertRaises(
+            frappe.PermissionError, self.receive, self.telegram_bot.name, self.secret_token)
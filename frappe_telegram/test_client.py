@@ -0,0 +1,140 @@
+import time
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from telegram.error import BadRequest, RetryAfter
+from frappe_telegram.client import send_bulk, send_file_bulk, send_rate_limited
+from frappe_telegram.utils.rate_limit import RateLimiter
+
+
+class StubBot():
+    """
+    Records every send. Chats in `retry_after` are answered with as many RetryAfter first,
+    and chats in `failing` with a BadRequest
+    """
+
+    def __init__(self, retry_after: dict = None, failing: tuple = ()):
+        self.retry_after = dict(retry_after or {})
+        self.failing = failing
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def send(self, chat_id, **kwargs):
+        with self.lock:
+            self.calls.append((chat_id, time.monotonic(), kwargs))
+            if self.retry_after.get(chat_id):
+                self.retry_after[chat_id] -= 1
+                raise RetryAfter(0.1)
+        if chat_id in self.failing:
+            raise BadRequest("Chat not found")
+
+    def send_message(self, chat_id, text=None, **kwargs):
+        self.send(chat_id, text=text, **kwargs)
+        return SimpleNamespace(chat_id=chat_id, text=text, effective_attachment=None)
+
+    def send_document(self, chat_id, document=None, **kwargs):
+        self.send(chat_id, document=document, **kwargs)
+        file_id = "uploaded-file-id" if document.startswith("https://") else document
+        return SimpleNamespace(
+            chat_id=chat_id, text=None, effective_attachment=SimpleNamespace(file_id=file_id))
+
+
+class TestBulkSend(unittest.TestCase):
+
+    # Telegram User name: (user, telegram_user_id)
+    recipients = {
+        "TU-1": ("user1@example.com", 1),
+        "TU-2": (None, 2),
+        "TU-3": (None, 3),
+    }
+
+    def setUp(self):
+        self.bot = StubBot()
+        for target, kwargs in (
+                ("get_bot", dict(side_effect=lambda telegram_bot: self.bot)),
+                ("get_telegram_user_ids", dict(side_effect=self.get_telegram_user_ids)),
+                ("get_rate_limiter", dict(side_effect=lambda telegram_bot: RateLimiter(
+                    global_rate=1000, per_chat_rate=1000))),
+                ("log_outgoing_message", dict())):
+            patcher = patch(f"frappe_telegram.client.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_telegram_user_ids(self, users=None, telegram_users=None):
+        return {
+            name: recipient for name, recipient in self.recipients.items()
+            if name in (telegram_users or []) or recipient[0] in (users or [])}
+
+    def test_send_rate_limited_retry_after(self):
+        """
+        Sends are held off for as long as Telegram asks, up to max_retries times
+        """
+        bot = StubBot(retry_after={1: 2})
+        limiter = RateLimiter(global_rate=1000, per_chat_rate=1000)
+
+        started_on = time.monotonic()
+        message = send_rate_limited(bot, limiter, 1, text="Hi")
+        self.assertEqual(message.chat_id, 1)
+        self.assertEqual(len(bot.calls), 3)
+        self.assertGreaterEqual(time.monotonic() - started_on, 0.19)
+
+        bot = StubBot(retry_after={1: 2})
+        self.assertRaises(RetryAfter, send_rate_limited, bot, limiter, 1, max_retries=1, text="Hi")
+        self.assertEqual(len(bot.calls), 2)
+
+    def test_send_rate_limited_per_chat_pacing(self):
+        bot = StubBot()
+        limiter = RateLimiter(global_rate=1000, per_chat_rate=10)
+        for chat_id in (1, 2, 1, 1):
+            send_rate_limited(bot, limiter, chat_id, text="Hi")
+
+        sent_on = [x[1] for x in bot.calls if x[0] == 1]
+        for previous, current in zip(sent_on, sent_on[1:]):
+            self.assertGreaterEqual(current - previous, 0.09)
+        # Another chat isn't held back by the first one
+        self.assertLess(bot.calls[1][1] - bot.calls[0][1], 0.05)
+
+    def test_send_bulk(self):
+        self.bot.failing = (3,)
+        progress = []
+
+        result = send_bulk(
+            "Hi", users=["user1@example.com", "nobody@example.com"],
+            telegram_users=["TU-2", "TU-3", "TU-4"], from_bot="TestBot",
+            on_progress=lambda done, total: progress.append((done, total)))
+
+        self.assertEqual(sorted(result.sent), ["TU-1", "TU-2"])
+        self.assertEqual(list(result.failed), ["TU-3"])
+        self.assertEqual(sorted(result.unresolved), ["TU-4", "nobody@example.com"])
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(sorted(x[0] for x in self.bot.calls), [1, 2, 3])
+
+    def test_send_file_bulk_file_id(self):
+        result = send_file_bulk(
+            "existing-file-id", telegram_users=list(self.recipients), from_bot="TestBot")
+
+        self.assertEqual(result.file_id, "existing-file-id")
+        self.assertEqual(sorted(result.sent), sorted(self.recipients))
+        self.assertEqual({x[2]["document"] for x in self.bot.calls}, {"existing-file-id"})
+
+    def test_send_file_bulk_url(self):
+        """
+        A URL is uploaded once, and the file_id Telegram returns is sent to everyone else
+        """
+        url = "https://example.com/files/report.pdf"
+        result = send_file_bulk(url, telegram_users=list(self.recipients), from_bot="TestBot")
+
+        self.assertEqual(result.file_id, "uploaded-file-id")
+        self.assertEqual(sorted(result.sent), sorted(self.recipients))
+        self.assertEqual(
+            sorted(x[2]["document"] for x in self.bot.calls),
+            [url, "uploaded-file-id", "uploaded-file-id"])
+
+    def test_send_file_bulk_missing_file(self):
+        self.assertRaises(
+            frappe.DoesNotExistError, send_file_bulk, "/files/missing-report.pdf",
+            telegram_users=list(self.recipients), from_bot="TestBot")
+        self.assertEqual(self.bot.calls, [])
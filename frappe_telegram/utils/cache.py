@@ -0,0 +1,59 @@
+import time
+import threading
+from collections import OrderedDict
+
+"""
+In-process caches for the Update hot path.
+Unlike frappe.cache() (redis) or frappe.local.document_cache (per request), these live for the
+lifetime of the process, so hits cost neither a db nor a network round-trip.
+"""
+
+_missing = object()
+
+
+class TTLCache():
+    """
+    A thread-safe, size-bounded mapping whose entries expire `ttl` seconds after they were set.
+    The least recently used entry is evicted when `maxsize` is exceeded.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            value, expires_on = self.data.get(key, (_missing, 0))
+            if value is _missing:
+                return default
+
+            if expires_on < time.monotonic():
+                del self.data[key]
+                return default
+
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            value, _ = self.data.pop(key, (default, 0))
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,189 @@
+import logging
+import threading
+
+import frappe
+from frappe.utils import get_datetime
+from frappe_telegram.utils.connection import ensure_site_connection, release_site_connection
+
+"""
+Keeps Telegram Chat's last_message_on & last_message_content up to date.
+Instead of saving the whole Telegram Chat (and its child tables) on every message, a single
+targeted UPDATE of the two columns is made. The UPDATE only ever moves last_message_on forward,
+so that late or concurrent writers cannot roll a chat back to an older message.
+
+Within bot processes, the updates are coalesced: only the latest message of each chat is kept in
+memory and written every COALESCE_INTERVAL seconds, ie at most one UPDATE per chat per interval.
+
+New messages are also pushed to the Telegram Chat View over realtime: the messages to the room of
+their Telegram Chat, and the new last messages to the room of the Telegram Chat doctype, for the
+chat list. When coalesced, a burst of messages in a chat makes a single push.
+"""
+
+# Seconds between two writes of the same chat
+COALESCE_INTERVAL = 1
+
+# Messages of a chat pushed at once; the chat view loads older ones on scrolling up
+MAX_PUSHED_MESSAGES = 50
+
+# Fields of a message pushed to the chat view; same as load_chat_messages
+REALTIME_FIELDS = ("name", "content", "from_user", "from_bot", "message_id", "creation")
+
+MESSAGE_EVENT = "telegram_chat_messages"
+CHAT_LIST_EVENT = "telegram_chat_list_update"
+
+logger = logging.getLogger(__name__)
+
+_coalescer = None
+_coalescer_users = 0
+_coalescer_lock = threading.Lock()
+
+
+def update_last_message(chat: str, message_on, content: str, messages: list = None):
+    """
+    messages: `list`
+        The new messages of the chat, as dicts, to push to the chat view
+    """
+    message_on = get_datetime(message_on)
+    coalescer = _coalescer
+    if coalescer:
+        coalescer.add(chat, message_on, content, messages)
+    else:
+        set_last_message(chat, message_on, content)
+        publish_chat_updates(
+            {chat: (message_on, content)}, {chat: messages or []}, after_commit=True)
+
+
+def set_last_message(chat: str, message_on, content: str):
+    frappe.db.sql(
+        """
+        UPDATE `tabTelegram Chat`
+        SET last_message_on=%(message_on)s, last_message_content=%(content)s
+        WHERE name=%(chat)s AND (last_message_on IS NULL OR last_message_on <= %(message_on)s)
+        """,
+        dict(chat=chat, message_on=message_on, content=content))
+
+
+def publish_chat_updates(last_messages: dict, messages: dict, after_commit=False):
+    """
+    last_messages: `dict`
+        chat: (message_on, content)
+    messages: `dict`
+        chat: list of new messages
+    """
+    from frappe.realtime import get_doctype_room
+
+    for chat, chat_messages in messages.items():
+        if not chat_messages:
+            continue
+        frappe.publish_realtime(
+            MESSAGE_EVENT, dict(chat=chat, messages=chat_messages[-MAX_PUSHED_MESSAGES:]),
+            doctype="Telegram Chat", docname=chat, after_commit=after_commit)
+
+    frappe.publish_realtime(
+        CHAT_LIST_EVENT,
+        dict(chats=[
+            dict(name=chat, last_message_on=message_on, last_message_content=content)
+            for chat, (message_on, content) in last_messages.items()]),
+        room=get_doctype_room("Telegram Chat"), after_commit=after_commit)
+
+
+def start_last_message_coalescer(site: str):
+    """
+    Coalesces last message updates of this process from now on. Can be called by multiple
+    dispatchers; the coalescer is stopped when the last of them calls `stop_last_message_coalescer`
+    """
+    global _coalescer, _coalescer_users
+    with _coalescer_lock:
+        if not _coalescer:
+            _coalescer = LastMessageCoalescer(site=site)
+            _coalescer.start()
+        _coalescer_users += 1
+
+
+def stop_last_message_coalescer():
+    global _coalescer, _coalescer_users
+    with _coalescer_lock:
+        _coalescer_users -= 1
+        if _coalescer_users > 0 or not _coalescer:
+            return
+
+        coalescer, _coalescer = _coalescer, None
+
+    coalescer.stop()
+
+
+class LastMessageCoalescer(threading.Thread):
+
+    def __init__(self, site: str, interval: float = COALESCE_INTERVAL):
+        super().__init__(name="telegram-last-message", daemon=True)
+        self.site = site
+        self.interval = interval
+        self.pending = {}
+        self.pending_messages = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def add(self, chat: str, message_on, content: str, messages: list = None):
+        with self.lock:
+            last = self.pending.get(chat)
+            if not last or last[0] <= message_on:
+                self.pending[chat] = (message_on, content)
+
+            if messages:
+                chat_messages = self.pending_messages.setdefault(chat, [])
+                chat_messages.extend(messages)
+                del chat_messages[:-MAX_PUSHED_MESSAGES]
+
+    def run(self):
+        try:
+            while not self.stop_event.wait(self.interval):
+                self.flush()
+            self.flush()
+        finally:
+            release_site_connection()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            pending_messages, self.pending_messages = self.pending_messages, {}
+
+        if not pending:
+            return
+
+        try:
+            ensure_site_connection(self.site)
+            for chat, (message_on, content) in pending.items():
+                set_last_message(chat, message_on, content)
+            frappe.db.commit()
+        except Exception:
+            logger.exception("Failed updating the last message of %s chats", len(pending))
+            try:
+                frappe.db.rollback()
+            except Exception:
+                release_site_connection()
+            # Retried on the next tick
+            self.requeue(pending, pending_messages)
+            return
+
+        try:
+            publish_chat_updates(pending, pending_messages)
+        except Exception:
+            logger.exception("Failed publishing the last message of %s chats", len(pending))
+
+    def requeue(self, pending: dict, pending_messages: dict):
+        """
+        Merges the updates of a failed flush back, under the ones added since
+        """
+        with self.lock:
+            for chat, (message_on, content) in pending.items():
+                last = self.pending.get(chat)
+                if not last or last[0] < message_on:
+                    self.pending[chat] = (message_on, content)
+
+            for chat, messages in pending_messages.items():
+                chat_messages = messages + self.pending_messages.get(chat, [])
+                self.pending_messages[chat] = chat_messages[-MAX_PUSHED_MESSAGES:]
@@ -0,0 +1,92 @@
+import time
+import threading
+
+import frappe
+
+"""
+Long-lived Frappe site contexts for bot worker threads.
+frappe.local is thread-local, so every thread that calls `ensure_site_connection`
+keeps its own site context & db connection until `release_site_connection` is called.
+Only the request-scoped locals are reset between two updates.
+"""
+
+# Seconds a connection may stay idle before it is pinged prior to being reused
+HEALTH_CHECK_INTERVAL = 30
+
+_thread_state = threading.local()
+
+
+def ensure_site_connection(site: str):
+    """
+    Makes sure the current thread has an initialized site with a live db connection.
+    The connection is made on the first call and reused afterwards. Connections that
+    were idle for longer than HEALTH_CHECK_INTERVAL are pinged and re-established if dropped.
+    """
+    if getattr(frappe.local, "site", None) != site:
+        release_site_connection()
+        frappe.init(site=site)
+
+    if not frappe.db:
+        frappe.connect()
+    elif time.monotonic() - getattr(_thread_state, "last_used", 0) > HEALTH_CHECK_INTERVAL \
+            and not is_connection_alive():
+        reconnect()
+
+    _thread_state.last_used = time.monotonic()
+
+
+def is_connection_alive() -> bool:
+    try:
+        frappe.db.sql("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+def reconnect():
+    try:
+        frappe.db.close()
+    except Exception:
+        pass
+
+    frappe.connect()
+
+
+def reset_request_locals():
+    """
+    Resets the request-scoped attributes of frappe.local the same way frappe.init does,
+    leaving the site config, db connection & meta cache intact.
+    """
+    local = frappe.local
+    local.flags = frappe._dict()
+    local.error_log = []
+    local.message_log = []
+    local.debug_log = []
+    local.realtime_log = []
+    local.rollback_observers = []
+    local.form_dict = frappe._dict()
+    local.response = frappe._dict(docs=[])
+    local.cache = {}
+    local.document_cache = {}
+    local.role_permissions = {}
+    local.new_doc_templates = {}
+    local.link_count = {}
+
+    # frappe.connect logs in as Administrator; keep updates starting off the same way
+    frappe.set_user("Administrator")
+
+
+def release_site_connection():
+    """
+    Closes the db connection & destroys the site context of the current thread, if any
+    """
+    if not getattr(frappe.local, "site", None):
+        return
+
+    try:
+        if frappe.db:
+            frappe.db.rollback()
+    except Exception:
+        pass
+    finally:
+        frappe.destroy()
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+import frappe
+from frappe_telegram.utils.cache import TTLCache
+
+"""
+Drops Updates that were already received.
+Telegram sends a webhook Update again when it isn't answered quickly enough, and replicas behind a
+load balancer can each receive a copy of the same Update. Updates are deduplicated in two phases:
+- An Update is claimed in redis with SET NX for a short while, so that only the first claim of an
+  Update across all processes gets it processed. The claim expires if the process dies before the
+  Update is processed, so that the Update is processed when it is received again.
+- Once processed, the Update is marked as done for a long while, and the claim is released.
+Only a single process can poll the Updates of a bot; the claims of a process that died would only
+hold its Updates back. So polled Updates are only checked against the done markers.
+update_ids done in this process are also kept in memory, so that repeats of them are dropped
+without a round-trip to redis. Every repeat extends the window an Update is remembered for.
+"""
+
+# Seconds an update_id is remembered for, since it was last seen done
+DEDUP_TTL = 3600
+
+# Seconds an Update stays claimed by a process that doesn't mark it done
+PROCESSING_TTL = 120
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator():
+    """
+    Made in the site context of the Telegram Bot; is_duplicate, done & release need none
+    """
+
+    def __init__(self, telegram_bot: str, ttl: int = DEDUP_TTL,
+                 processing_ttl: int = PROCESSING_TTL):
+        self.ttl = ttl
+        self.processing_ttl = processing_ttl
+        self.redis = frappe.cache()
+        self.key_prefix = frappe.cache().make_key(f"telegram_update_id|{telegram_bot}|")
+        self.done_update_ids = TTLCache(maxsize=10000, ttl=ttl)
+        self.claimed_update_ids = TTLCache(maxsize=10000, ttl=processing_ttl)
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def is_duplicate(self, update: object, exclusive: bool = True) -> bool:
+        """
+        Returns True if the Update is done, or claimed by another process when `exclusive`.
+        Else, the Update is claimed by this process, and has to be passed to `done` or `release`
+        """
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            return False
+
+        duplicate = update_id in self.done_update_ids or (
+            exclusive and update_id in self.claimed_update_ids)
+        if not duplicate:
+            try:
+                duplicate = not self.claim(update_id, exclusive)
+            except Exception:
+                # Rather process an Update twice than not at all
+                logger.exception("Failed claiming update_id %s", update_id)
+
+        if duplicate:
+            with self.lock:
+                self.duplicates += 1
+        else:
+            self.claimed_update_ids.set(update_id, True)
+
+        return duplicate
+
+    def claim(self, update_id: int, exclusive: bool) -> bool:
+        done_key, claim_key = self.get_keys(update_id)
+        if exclusive:
+            # Claimed before checking for done, since the claim is released only once done is set
+            claimed = self.redis.set(claim_key, 1, ex=self.processing_ttl, nx=True)
+        else:
+            claimed = self.redis.set(claim_key, 1, ex=self.processing_ttl)
+
+        if self.redis.exists(done_key):
+            if claimed:
+                self.redis.delete(claim_key)
+            self.redis.expire(done_key, self.ttl)
+            self.done_update_ids.set(update_id, True)
+            return False
+
+        return bool(claimed)
+
+    def done(self, update: object):
+        """
+        Marks a claimed Update as processed
+        """
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            return
+
+        self.done_update_ids.set(update_id, True)
+        self.claimed_update_ids.pop(update_id)
+        done_key, claim_key = self.get_keys(update_id)
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.set(done_key, 1, ex=self.ttl)
+            pipeline.delete(claim_key)
+            pipeline.execute()
+        except Exception:
+            logger.exception("Failed marking update_id %s as done", update_id)
+
+    def release(self, update: object):
+        """
+        Releases the claim of an Update that wasn't processed, so that it is if received again
+        """
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            return
+
+        self.claimed_update_ids.pop(update_id)
+        try:
+            self.redis.delete(self.get_keys(update_id)[1])
+        except Exception:
+            logger.exception("Failed releasing update_id %s", update_id)
+
+    def get_keys(self, update_id: int) -> tuple:
+        """
+        Returns the keys of the done marker & the claim of the Update
+        """
+        return f"{self.key_prefix}{update_id}", f"{self.key_prefix}{update_id}|processing"
@@ -0,0 +1,272 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import frappe
+from frappe.utils import now_datetime
+from frappe_telegram.utils.connection import ensure_site_connection, release_site_connection
+from frappe_telegram.utils.chat_activity import update_last_message, REALTIME_FIELDS
+
+"""
+Write-behind buffer for Telegram Message logging.
+When enabled, incoming & outgoing messages are not inserted on the critical path of an Update.
+They are collected in a bounded in-memory buffer and bulk inserted by a background thread every
+FLUSH_INTERVAL seconds or FLUSH_SIZE rows, whichever comes first.
+The buffer is flushed once more when stopped, so that nothing is lost on a graceful shutdown.
+Rows of a flush that fails (for eg: the db is unreachable) are put back in the buffer and retried
+on the next flush. While the buffer stays full, messages are inserted directly instead.
+"""
+
+# Seconds between two flushes
+FLUSH_INTERVAL = 0.5
+
+# Rows that trigger a flush right away
+FLUSH_SIZE = 100
+
+# Adding to a full buffer blocks until the flusher catches up
+MAX_SIZE = 10000
+
+# Seconds to wait for room in a full buffer, before inserting the message directly
+ADD_TIMEOUT = 2
+
+MESSAGE_FIELDS = (
+    "name", "owner", "creation", "modified", "modified_by", "docstatus", "idx",
+    "chat", "message_id", "content", "from_user", "from_bot",
+)
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_users = 0
+_buffer_lock = threading.Lock()
+
+
+def get_message_buffer() -> "TelegramMessageBuffer":
+    """
+    Returns the active buffer of this process, if buffered logging is enabled
+    """
+    return _buffer
+
+
+def start_message_buffer(site: str):
+    """
+    Enables buffered logging for this process. Can be called by multiple dispatchers;
+    the buffer is stopped when the last of them calls `stop_message_buffer`
+    """
+    global _buffer, _buffer_users
+    with _buffer_lock:
+        if not _buffer:
+            _buffer = TelegramMessageBuffer(site=site)
+            _buffer.start()
+        _buffer_users += 1
+
+
+def stop_message_buffer():
+    global _buffer, _buffer_users
+    with _buffer_lock:
+        _buffer_users -= 1
+        if _buffer_users > 0 or not _buffer:
+            return
+
+        buffer, _buffer = _buffer, None
+
+    buffer.stop()
+
+
+class TelegramMessageBuffer():
+
+    def __init__(self, site: str, flush_interval: float = FLUSH_INTERVAL,
+                 flush_size: int = FLUSH_SIZE, max_size: int = MAX_SIZE):
+        self.site = site
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_size = max_size
+
+        self.rows = OrderedDict()
+        self.condition = threading.Condition()
+        # Held while a batch is being written; lets `update` wait for in-flight rows to land
+        self.flush_lock = threading.Lock()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="telegram-message-buffer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+        self.thread.join()
+
+    def add(self, doc, timeout: float = ADD_TIMEOUT) -> bool:
+        """
+        Queues a new Telegram Message doc for insertion. The doc is named right away,
+        so that it can be referred to before it is flushed
+        Returns False, leaving the doc untouched, if the buffer stayed full for `timeout` seconds
+        """
+        with self.condition:
+            deadline = time.monotonic() + timeout
+            while len(self.rows) >= self.max_size and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.notify_all()
+                self.condition.wait(remaining)
+
+            if not doc.name:
+                doc.name = frappe.generate_hash(doc.doctype, 10)
+
+            timestamp = now_datetime()
+            doc.owner = doc.modified_by = frappe.session.user
+            doc.creation = doc.modified = timestamp
+            row = {field: doc.get(field) for field in MESSAGE_FIELDS}
+            row.update(docstatus=0, idx=0)
+
+            self.rows[doc.name] = row
+            if len(self.rows) >= self.flush_size:
+                self.condition.notify_all()
+
+        return True
+
+    def update(self, name: str, **values) -> bool:
+        """
+        Updates a message that is yet to be flushed
+        Returns False if the message is not in the buffer (anymore), in which case it is in the db
+        """
+        with self.flush_lock, self.condition:
+            row = self.rows.get(name)
+            if not row:
+                return False
+
+            row.update(values)
+            return True
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    if not self.stopping:
+                        self.condition.wait_for(
+                            lambda: self.stopping or len(self.rows) >= self.flush_size,
+                            timeout=self.flush_interval)
+                    stopping = self.stopping
+
+                try:
+                    flushed = self.flush()
+                except Exception:
+                    logger.exception("Telegram Message Buffer flush failed")
+                    flushed = False
+
+                if stopping:
+                    if not flushed:
+                        self.spill()
+                    break
+
+                if not flushed:
+                    # Back off before retrying, instead of retrying a full buffer right away
+                    with self.condition:
+                        self.condition.wait_for(lambda: self.stopping, timeout=self.flush_interval)
+        finally:
+            release_site_connection()
+
+    def flush(self) -> bool:
+        """
+        Returns False if the rows couldn't be written, in which case they are back in the buffer
+        """
+        with self.flush_lock:
+            with self.condition:
+                rows = list(self.rows.values())
+                self.rows = OrderedDict()
+                self.condition.notify_all()
+
+            if not rows:
+                return True
+
+            started_on = time.monotonic()
+            try:
+                ensure_site_connection(self.site)
+                try:
+                    insert_messages(rows)
+                    frappe.db.commit()
+                    rows = []
+                except Exception:
+                    frappe.db.rollback()
+                    insert_messages_one_by_one(rows)
+            except Exception:
+                logger.exception("Failed flushing %s messages; retrying", len(rows))
+                # The connection may be broken; start afresh on the next flush
+                release_site_connection()
+                self.requeue(rows)
+                return False
+
+            logger.debug("Flushed messages in %.3fs", time.monotonic() - started_on)
+            return True
+
+    def requeue(self, rows):
+        """
+        Puts rows of a failed flush back in front of the buffer
+        """
+        with self.condition:
+            requeued = OrderedDict((row["name"], row) for row in rows)
+            requeued.update(self.rows)
+            self.rows = requeued
+
+    def spill(self):
+        """
+        Last resort on shutdown: the rows that couldn't be written go to the log
+        """
+        with self.condition:
+            rows, self.rows = list(self.rows.values()), OrderedDict()
+
+        if rows:
+            logger.error(
+                "Dropping %s unwritten Telegram Messages: %s",
+                len(rows), json.dumps(rows, default=str))
+
+
+def insert_messages(rows):
+    frappe.db.bulk_insert(
+        "Telegram Message", MESSAGE_FIELDS,
+        [tuple(row[field] for field in MESSAGE_FIELDS) for row in rows])
+
+    update_last_messages(rows)
+
+
+def insert_messages_one_by_one(rows):
+    """
+    Fallback when a bulk insert fails; a bad row shouldn't cost the rest of the batch
+    Rows are removed from `rows` as they are written (or logged as bad), so that whatever is left
+    when the connection itself fails can be retried
+    """
+    while rows:
+        row = rows[0]
+        try:
+            frappe.get_doc(dict(row, doctype="Telegram Message")).db_insert()
+            update_last_messages([row])
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(
+                title="Telegram Message Buffer Flush Error", message=frappe.get_traceback())
+            frappe.db.commit()
+        rows.pop(0)
+
+
+def update_last_messages(rows):
+    """
+    Bulk inserts skip TelegramMessage.after_insert. Set the last message of each chat instead
+    """
+    last_messages = {}
+    messages = {}
+    for row in rows:
+        last_messages[row["chat"]] = row
+        messages.setdefault(row["chat"], []).append(
+            {field: row[field] for field in REALTIME_FIELDS})
+
+    for chat, row in last_messages.items():
+        update_last_message(chat, row["creation"], row["content"], messages=messages[chat])
@@ -1,12 +1,35 @@
 import frappe
-from telegram.ext import Dispatcher, ExtBot, Updater
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher, DispatcherHandlerStop, ExtBot, Updater
+from telegram.utils.helpers import DEFAULT_FALSE
 from frappe_telegram.handlers.logging import log_outgoing_message
+from frappe_telegram.utils.connection import (
+    ensure_site_connection, reset_request_locals, release_site_connection)
+from frappe_telegram.utils.scheduler import ChatShardScheduler
+from frappe_telegram.utils.message_buffer import start_message_buffer, stop_message_buffer
+from frappe_telegram.utils.chat_activity import (
+    start_last_message_coalescer, stop_last_message_coalescer)
+from frappe_telegram.utils.stats import StatsReporter
+from frappe_telegram.utils.webhook import parse_update
+from frappe_telegram.utils.dedup import UpdateDeduplicator
+from frappe_telegram.utils.routing import HandlerIndex
 
 
 """
 For each incoming Update, we will have frappe initialized.
 We will override Dispatcher and Bot instance
 - Dispatcher is overridden for initializing frappe for each incoming Update
+  With persistent_connections, the site context & db connection of the dispatching thread
+  is kept alive across Updates and only the request-scoped locals are reset
+  With update_workers, Updates are sharded by chat onto a pool of worker threads, keeping
+  each chat in order while independent chats are processed in parallel. The pool can be
+  shared by the dispatchers of many bots hosted in one process
+  With buffered_logging, Telegram Messages are bulk inserted in the background
+  Updates received over webhook arrive raw, and are parsed here, off the request path
+  Updates already received, by this or any other process, are dropped before any processing
+  Updates are only checked against the handlers a HandlerIndex routes them to
+  When polled by a DurablePoller, every processed Update is reported to its UpdateTracker
+  The last message of each Telegram Chat is written in the background, at most once a second
 - Bot is overridden for loggign outgoing messages
 NOTE:
     Class attributes that starts with __ is Mangled
@@ -24,7 +47,7 @@ class FrappeTelegramExtBot(ExtBot):
         new_bot = cls(
             bot.token,
             bot.base_url,
-            request=updater._request,
+            request=bot.request,
             defaults=bot.defaults,
             arbitrary_callback_data=bot.arbitrary_callback_data,
         )
@@ -45,8 +68,21 @@ class FrappeTelegramDispatcher(Dispatcher):
     # The Frappe Site
     site: str
 
+    # Reuse the site context & db connection of the thread between Updates
+    persistent_connections: bool
+
+    # Shards Updates by chat onto a pool of worker threads, when update_workers > 1
+    scheduler: ChatShardScheduler
+
+    # False when the scheduler is shared by the dispatchers of many bots, and started by its owner
+    owns_scheduler: bool
+
+    # Defer Telegram Message inserts to the process-wide write-behind buffer
+    buffered_logging: bool
+
     @classmethod
-    def make(cls, site, updater):
+    def make(cls, site, updater, persistent_connections=False, update_workers=0,
+             buffered_logging=False, scheduler=None):
         dispatcher = updater.dispatcher
         return cls(
             site,
@@ -59,21 +95,244 @@ class FrappeTelegramDispatcher(Dispatcher):
             persistence=dispatcher.persistence,
             use_context=dispatcher.use_context,
             context_types=dispatcher.context_types,
+            persistent_connections=persistent_connections,
+            update_workers=update_workers,
+            buffered_logging=buffered_logging,
+            scheduler=scheduler,
         )
 
-    def __init__(self, site, *args, **kwargs):
+    def __init__(self, site, *args, persistent_connections=False, update_workers=0,
+                 buffered_logging=False, scheduler=None, **kwargs):
         self.site = site
+        self.persistent_connections = persistent_connections
+        self.buffered_logging = buffered_logging
+        self.scheduler = scheduler
+        self.owns_scheduler = False
+        self.stats_key = None
+        self.stats_reporter = None
+        self.services_stopped = False
+        self.webhook_ingress = None
+        self.update_tracker = None
+        self.handler_index = None
+        self.allowed_updates = None
         print("Using Patched Frappe Telegram Dispatcher ✅")
-        return super().__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
+        self.deduplicator = UpdateDeduplicator(self.bot.telegram_bot)
+
+        if not self.scheduler and update_workers > 1:
+            # Bounded along with the update_queue, so that its overflow kicks in once the
+            # workers fall behind, instead of the backlog piling up on the shards
+            self.scheduler = ChatShardScheduler(
+                self.process_update_in_frappe_context, workers=update_workers,
+                on_worker_exit=self.on_worker_exit, name=self.bot.telegram_bot,
+                max_pending=self.update_queue.maxsize)
+            self.owns_scheduler = True
+
+    def start(self, ready=None) -> None:
+        start_last_message_coalescer(self.site)
+        if self.buffered_logging:
+            start_message_buffer(self.site)
+
+        if self.owns_scheduler:
+            self.scheduler.start()
+
+        self.stats_reporter = StatsReporter(
+            site=self.site, telegram_bot=self.stats_key or self.bot.telegram_bot,
+            collect=self.get_stats)
+        self.stats_reporter.start()
+
+        try:
+            super().start(ready=ready)
+        finally:
+            if self.owns_scheduler:
+                # Lets the workers finish off the Updates already handed to them
+                self.scheduler.stop()
+            self.stop_services()
+            self.on_worker_exit()
+
+    def stop_services(self) -> None:
+        """
+        Stops the message buffer, the last message coalescer & the stats reporter started along
+        with the dispatcher, flushing whatever they hold. Also called before the process is cut
+        short, with Updates still in flight
+        """
+        if self.services_stopped:
+            return
+        self.services_stopped = True
+
+        if self.buffered_logging:
+            # Flushes whatever is left in the buffer
+            stop_message_buffer()
+        stop_last_message_coalescer()
+        if self.stats_reporter:
+            self.stats_reporter.stop()
+
+    def add_handler(self, handler, group=0) -> None:
+        super().add_handler(handler, group=group)
+        self.handler_index = None
+
+    def remove_handler(self, handler, group=0) -> None:
+        super().remove_handler(handler, group=group)
+        self.handler_index = None
+
+    def get_handler_index(self) -> HandlerIndex:
+        """
+        Compiled on the first Update, and again after any handler is added or removed
+        """
+        handler_index = self.handler_index
+        if not handler_index:
+            handler_index = self.handler_index = HandlerIndex(self.groups, self.handlers)
+        return handler_index
+
+    def dispatch_update(self, update: object) -> None:
+        """
+        Same as Dispatcher.process_update, but only checks the handlers the Update is routed to
+        """
+        if isinstance(update, TelegramError):
+            return super().process_update(update)
+
+        context = None
+        handled = False
+        sync_modes = []
+
+        for group, handlers in self.get_handler_index().route(update):
+            try:
+                for handler, _prefix in handlers:
+                    check = handler.check_update(update)
+                    if check is not None and check is not False:
+                        if not context and self.use_context:
+                            context = self.context_types.context.from_update(update, self)
+                            context.refresh_data()
+                        handled = True
+                        sync_modes.append(handler.run_async)
+                        handler.handle_update(update, self, check, context)
+                        break
+
+            # Stop processing with any other handler
+            except DispatcherHandlerStop:
+                self.logger.debug('Stopping further handlers due to DispatcherHandlerStop')
+                self.update_persistence(update=update)
+                break
+
+            # Dispatch any error
+            except Exception as exc:
+                try:
+                    self.dispatch_error(update, exc)
+                except DispatcherHandlerStop:
+                    self.logger.debug('Error handler stopped further handlers')
+                    break
+                # Errors should not stop the thread
+                except Exception:
+                    self.logger.exception('An uncaught error was raised while handling the error.')
+
+        # Update persistence, if handled
+        handled_only_async = all(sync_modes)
+        if handled:
+            # Respect default settings
+            if all(mode is DEFAULT_FALSE for mode in sync_modes) and self.bot.defaults:
+                handled_only_async = self.bot.defaults.run_async
+            # If update was only handled by async handlers, we don't need to update here
+            if not handled_only_async:
+                self.update_persistence(update=update)
+
+    def on_worker_exit(self):
+        if self.persistent_connections:
+            release_site_connection()
+
+    def get_stats(self) -> dict:
+        stats = dict(
+            update_queue_depth=self.update_queue.qsize(),
+            duplicate_updates=self.deduplicator.duplicates)
+        if self.scheduler:
+            stats["scheduler"] = self.scheduler.get_stats()
+        if self.webhook_ingress:
+            stats["webhook"] = self.webhook_ingress.get_stats()
+        if self.update_tracker:
+            stats["update_offset"] = self.update_tracker.get_offset()
+            stats["updates_in_flight"] = self.update_tracker.in_flight
+            stats["polling_held_back"] = self.update_tracker.held_back
+
+        return stats
 
     def process_update(self, update: object) -> None:
+        if isinstance(update, bytes):
+            # Raw Update from the webhook ingress
+            update = parse_update(update, self.bot)
+            if not update:
+                return
+
+        # Polled Updates are only ever received by this process
+        if self.deduplicator.is_duplicate(update, exclusive=not self.update_tracker):
+            if self.update_tracker:
+                self.update_tracker.done(update)
+            return
+
+        if self.scheduler:
+            return self.scheduler.submit(update, self.process_update_in_frappe_context)
+
+        return self.process_update_in_frappe_context(update)
+
+    def process_update_in_frappe_context(self, update: object) -> None:
+        processed = False
+        try:
+            if self.persistent_connections:
+                self.process_update_on_persistent_connection(update)
+            else:
+                self.process_update_on_new_connection(update)
+            processed = True
+        finally:
+            if processed:
+                self.deduplicator.done(update)
+            else:
+                self.deduplicator.release(update)
+            if self.update_tracker:
+                self.update_tracker.done(update)
+
+    def process_update_on_new_connection(self, update: object) -> None:
         try:
             frappe.init(site=self.site)
             frappe.flags.in_telegram_update = True
             frappe.connect()
-            super().process_update(update=update)
+            self.dispatch_update(update)
         except BaseException:
             frappe.log_error(title="Telegram Process Update Error", message=frappe.get_traceback())
         finally:
             frappe.db.commit()
             frappe.destroy()
+
+    def process_update_in_current_context(self, update: object) -> None:
+        """
+        Processes the Update on the site context & db connection set up by the caller, for eg:
+        the RQ job of an Update received on the site's webhook endpoint
+        """
+        if self.deduplicator.is_duplicate(update):
+            return
+
+        frappe.flags.in_telegram_update = True
+        processed = False
+        try:
+            self.dispatch_update(update)
+            processed = True
+        finally:
+            frappe.flags.in_telegram_update = False
+            if processed:
+                self.deduplicator.done(update)
+            else:
+                self.deduplicator.release(update)
+
+    def process_update_on_persistent_connection(self, update: object) -> None:
+        try:
+            ensure_site_connection(self.site)
+            reset_request_locals()
+            frappe.flags.in_telegram_update = True
+            self.dispatch_update(update)
+            frappe.db.commit()
+        except BaseException:
+            try:
+                frappe.db.rollback()
+                frappe.log_error(
+                    title="Telegram Process Update Error", message=frappe.get_traceback())
+                frappe.db.commit()
+            except BaseException:
+                # The connection is unusable; start afresh on the next Update
+                release_site_connection()
@@ -0,0 +1,284 @@
+import os
+import time
+import signal
+import logging
+import threading
+
+import frappe
+from telegram.ext import Updater
+
+"""
+Polling with a durable update offset & graceful drain.
+Telegram forgets every Update below the offset of the last getUpdates call. Updater.start_polling
+moves the offset past an Update as soon as it is fetched, so Updates fetched but not yet processed
+are lost when the bot is stopped. Here, getUpdates is only called with the offset of the oldest
+Update still queued or being processed, and Updates Telegram sends again meanwhile are skipped.
+Telegram returns at most 100 Updates from the offset, which bounds how far polling runs ahead of
+the oldest unprocessed Update. A single slow Update thus holds polling back once 100 Updates were
+fetched past it, however many update_workers are idle; those polls are counted as held_back.
+
+The offset is saved on the Telegram Bot every few seconds & on shutdown, and polling resumes from
+it on start. Saving the Telegram Bot (eg: from Desk) keeps the offset saved here.
+On SIGTERM, fetching stops and the Updates in flight get drain_timeout seconds to complete.
+Updates that don't make it are received again after the restart, while the messages of those that
+did are flushed before the process exits.
+Many bots polled from one process share a single UpdateOffsetKeeper, and are stopped together.
+"""
+
+# Seconds between two saves of the offset
+UPDATE_OFFSET_SAVE_INTERVAL = 5
+
+# Seconds given to the Updates in flight to complete on shutdown
+DRAIN_TIMEOUT = 20
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_offset(telegram_bot: str) -> int:
+    last_update_id = frappe.db.get_value("Telegram Bot", telegram_bot, "last_update_id")
+    return last_update_id + 1 if last_update_id else 0
+
+
+def set_update_offset(telegram_bot: str, offset: int):
+    frappe.db.set_value(
+        "Telegram Bot", telegram_bot, "last_update_id", offset - 1, update_modified=False)
+
+
+class UpdateTracker():
+    """
+    Keeps the update_ids of the Updates fetched and not yet processed
+    """
+
+    def __init__(self, offset: int = 0):
+        # update_id of the next Update to be fetched
+        self.next_update_id = offset
+        self.pending = set()
+        # Polls that only returned Updates still in flight
+        self.held_back = 0
+        self.condition = threading.Condition()
+
+    def track(self, updates: list) -> list:
+        """
+        Returns the Updates that weren't fetched before
+        """
+        with self.condition:
+            new_updates = [u for u in updates if u.update_id >= self.next_update_id]
+            if new_updates:
+                self.pending.update(u.update_id for u in new_updates)
+                self.next_update_id = new_updates[-1].update_id + 1
+            elif updates:
+                self.held_back += 1
+
+        return new_updates
+
+    def done(self, update: object):
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            return
+
+        with self.condition:
+            self.pending.discard(update_id)
+            self.condition.notify_all()
+
+    def get_offset(self) -> int:
+        """
+        Returns the update_id of the oldest Update not processed yet
+        """
+        with self.condition:
+            return min(self.pending) if self.pending else self.next_update_id
+
+    def wait(self, timeout: float):
+        """
+        Waits for an Update to complete
+        """
+        with self.condition:
+            self.condition.wait(timeout)
+
+    def wait_until_drained(self, timeout: float) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+
+class UpdateOffsetKeeper(threading.Thread):
+    """
+    Saves the offsets of the trackers added, by bot, every `interval` seconds, and once more
+    when stopped
+    """
+
+    def __init__(self, site: str, interval: float = UPDATE_OFFSET_SAVE_INTERVAL,
+                 name: str = "telegram"):
+        super().__init__(name=f"{name}:offset", daemon=True)
+        self.site = site
+        self.interval = interval
+        self.trackers = dict()
+        self.saved_offsets = dict()
+        self.stop_event = threading.Event()
+
+    def add(self, telegram_bot: str, tracker: UpdateTracker):
+        self.saved_offsets[telegram_bot] = tracker.get_offset()
+        self.trackers[telegram_bot] = tracker
+
+    def run(self):
+        frappe.init(site=self.site)
+        frappe.connect()
+        try:
+            while not self.stop_event.wait(self.interval):
+                self.save()
+            self.save()
+        finally:
+            frappe.destroy()
+
+    def save(self):
+        for telegram_bot, tracker in list(self.trackers.items()):
+            offset = tracker.get_offset()
+            if offset == self.saved_offsets.get(telegram_bot):
+                continue
+
+            try:
+                set_update_offset(telegram_bot, offset)
+                frappe.db.commit()
+                self.saved_offsets[telegram_bot] = offset
+            except Exception:
+                frappe.db.rollback()
+                logger.exception("Failed saving the update offset of %s", telegram_bot)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class DurablePoller():
+    """
+    Polls Updates for the updater's FrappeTelegramDispatcher, in place of Updater.start_polling
+    offset_keeper is shared with the pollers of other bots, started & stopped by its owner
+    """
+
+    def __init__(self, updater: Updater, site: str, poll_interval: float = 0,
+                 timeout: float = 10, drain_timeout: float = DRAIN_TIMEOUT,
+                 offset_keeper: UpdateOffsetKeeper = None):
+        self.updater = updater
+        self.site = site
+        self.telegram_bot = updater.bot.telegram_bot
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.drain_timeout = drain_timeout
+        self.tracker = None
+        self.offset_keeper = offset_keeper
+        self.owns_offset_keeper = not offset_keeper
+        self.held_back = False
+
+    def start(self):
+        with frappe.init_site(self.site):
+            frappe.connect()
+            offset = get_update_offset(self.telegram_bot)
+
+        self.tracker = UpdateTracker(offset)
+        self.updater.dispatcher.update_tracker = self.tracker
+        if self.owns_offset_keeper:
+            self.offset_keeper = UpdateOffsetKeeper(self.site, name=self.telegram_bot)
+        self.offset_keeper.add(self.telegram_bot, self.tracker)
+        if self.owns_offset_keeper:
+            self.offset_keeper.start()
+
+        self.updater.running = True
+        dispatcher_ready = threading.Event()
+        self.updater._init_thread(
+            self.updater.dispatcher.start, "dispatcher", ready=dispatcher_ready)
+        dispatcher_ready.wait()
+
+        # Not joined by Updater.stop; an ongoing getUpdates is abandoned on shutdown
+        threading.Thread(
+            target=self.poll, name=f"{self.telegram_bot}:poll", daemon=True).start()
+        logger.info("Polling %s from update_id %s", self.telegram_bot, offset)
+
+    def poll(self):
+        # Deletes the webhook, if any
+        self.updater._bootstrap(
+            -1, drop_pending_updates=False, webhook_url="", allowed_updates=None)
+        self.updater._network_loop_retry(
+            self.fetch_updates, self.updater.update_queue.put, "getting Updates",
+            self.poll_interval)
+
+    def fetch_updates(self) -> bool:
+        updates = self.updater.bot.get_updates(
+            self.tracker.get_offset(), timeout=self.timeout,
+            allowed_updates=self.updater.dispatcher.allowed_updates)
+
+        if not self.updater.running:
+            # Not confirmed to Telegram; they are fetched again after the restart
+            return False
+
+        new_updates = self.tracker.track(updates)
+        for update in new_updates:
+            self.updater.update_queue.put(update)
+
+        if updates and not new_updates:
+            if not self.held_back:
+                logger.info(
+                    "%s: polling held back by update_id %s, still in flight",
+                    self.telegram_bot, self.tracker.get_offset())
+            self.held_back = True
+            # Telegram only sent back Updates still in flight; give them a moment to complete
+            self.tracker.wait(1)
+        else:
+            self.held_back = False
+
+        return True
+
+    def idle(self):
+        """
+        Blocks until SIGINT / SIGTERM / SIGABRT and stops gracefully
+        """
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            signal.signal(sig, lambda signum, frame: stop_event.set())
+        while not stop_event.wait(1):
+            pass
+
+        self.stop()
+
+    def stop(self):
+        stop_pollers([self], drain_timeout=self.drain_timeout)
+
+
+def stop_pollers(pollers: list, drain_timeout: float = DRAIN_TIMEOUT, stop_services=None):
+    """
+    Stops fetching for every poller at once, and gives the Updates in flight drain_timeout
+    seconds in all to complete. If they don't, the messages of the Updates that did complete
+    are written out, along with `stop_services` when given, and the process exits right away
+    """
+    for poller in pollers:
+        poller.updater.running = False
+
+    deadline = time.monotonic() + drain_timeout
+    in_flight = 0
+    for poller in pollers:
+        if not poller.tracker.wait_until_drained(max(deadline - time.monotonic(), 0)):
+            in_flight += poller.tracker.in_flight
+            logger.warning(
+                "%s: %s Updates still in flight after %ss; they will be received again on start",
+                poller.telegram_bot, poller.tracker.in_flight, drain_timeout)
+
+    for offset_keeper in {poller.offset_keeper for poller in pollers}:
+        offset_keeper.stop()
+
+    if in_flight:
+        for poller in pollers:
+            poller.updater.dispatcher.stop_services()
+        if stop_services:
+            stop_services()
+        os._exit(1)
+
+    # Every dispatcher is asked to stop before waiting on any, so that they wind down together
+    for poller in pollers:
+        # Class attributes that starts with __ is Mangled
+        poller.updater.dispatcher._Dispatcher__stop_event.set()
+    for poller in pollers:
+        # Updater.stop would skip joining the threads of a dispatcher already stopped
+        poller.updater.job_queue.stop()
+        poller.updater.dispatcher.stop()
+        poller.updater._join_threads()
@@ -0,0 +1,304 @@
+import json
+import signal
+import logging
+import threading
+import multiprocessing
+from typing import Union
+
+import frappe
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher, Updater
+from frappe_telegram.frappe_telegram.doctype import TelegramBot
+from frappe_telegram.utils.scheduler import get_shard
+from frappe_telegram.utils.stats import StatsReporter
+from frappe_telegram.utils.webhook import parse_update
+
+"""
+Multi-process dispatching of Updates.
+A single ingress process (the poller or the webhook listener) receives all the Updates and fans
+them out to N worker processes. Updates are routed by their chat, so that every chat is handled
+by the same worker process, in order. Each worker has its own FrappeTelegramDispatcher with
+all the hooked handlers, and its own db connection(s).
+A worker that dies is respawned on the same queue, so that the Updates queued to it aren't lost.
+With a bounded update_queue, its size is split across the workers, bounding both the queue of
+each worker and the update_queue of its dispatcher. The ingress then blocks on a worker that
+falls behind, and the backlog builds up on the update_queue of the ingress, where it is bounded.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Workers are spawned fresh instead of forked, so that no db connection,
+# frappe.local or lock is shared with the ingress process
+mp_context = multiprocessing.get_context("spawn")
+
+# Seconds between two checks of the workers being alive
+WORKER_CHECK_INTERVAL = 5
+
+# Seconds to wait for the first worker to set up its handlers
+WORKER_READY_TIMEOUT = 120
+
+
+def make_ingress(
+        site: str,
+        telegram_bot: Union[str, TelegramBot],
+        processes: int,
+        persistent_connections=False,
+        update_workers=0,
+        buffered_logging=False,
+        update_queue_size=0) -> Updater:
+    """
+    Returns an Updater that hands off every Update it receives to a pool of worker processes
+    """
+    from queue import Queue
+    from contextlib import ExitStack
+    from frappe_telegram.bot import get_update_types
+
+    with frappe.init_site(site) if not frappe.db else ExitStack():
+        if not frappe.db:
+            frappe.connect()
+
+        if isinstance(telegram_bot, str):
+            telegram_bot = frappe.get_doc("Telegram Bot", telegram_bot)
+
+        updater = Updater(token=telegram_bot.get_password("api_token"))
+        if update_queue_size:
+            updater.update_queue = Queue(maxsize=update_queue_size)
+
+        # Else, the types of Update the handlers of the workers can match; see start_pool
+        allowed_updates = get_update_types(telegram_bot.allowed_updates) or None
+
+    pool = UpdateProcessPool(
+        site=site, telegram_bot=telegram_bot.name, processes=processes,
+        queue_size=get_worker_queue_size(update_queue_size, processes),
+        persistent_connections=persistent_connections, update_workers=update_workers,
+        buffered_logging=buffered_logging)
+
+    dispatcher = ProcessPoolDispatcher.make(pool=pool, updater=updater)
+    dispatcher.allowed_updates = allowed_updates
+    updater.dispatcher = dispatcher
+    updater.job_queue.set_dispatcher(dispatcher)
+
+    return updater
+
+
+def get_worker_queue_size(update_queue_size: int, processes: int) -> int:
+    """
+    Share of each worker in the update_queue_size of the ingress. Unbounded if it is
+    """
+    if not update_queue_size:
+        return 0
+
+    return max(update_queue_size // processes, 1)
+
+
+class UpdateProcessPool():
+    """
+    A fixed set of worker processes, each fed with Updates through its own queue
+    queue_size bounds the queue of each worker, and the update_queue of its dispatcher
+    """
+
+    def __init__(self, site: str, telegram_bot: str, processes: int, queue_size: int = 0,
+                 **worker_options):
+        self.site = site
+        self.telegram_bot = telegram_bot
+        self.processes = processes
+        self.queue_size = queue_size
+        self.worker_options = worker_options
+        self.queues = []
+        self.workers = []
+        self.worker_restarts = 0
+        # Workers report the allowed_updates of their dispatcher once set up
+        self.reports = mp_context.Queue()
+        self.allowed_updates = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.watchdog = None
+
+    def start(self):
+        """
+        Spawns the workers, and waits for the first of them to have set up its handlers
+        """
+        if self.workers:
+            return
+
+        self.stop_event.clear()
+        for i in range(self.processes):
+            self.queues.append(mp_context.Queue(maxsize=self.queue_size))
+            self.workers.append(self.spawn_worker(i))
+
+        try:
+            self.allowed_updates = self.reports.get(timeout=WORKER_READY_TIMEOUT)
+        except Exception:
+            logger.warning(
+                "No worker of %s ready after %ss; the types of Update received stay unchanged",
+                self.telegram_bot, WORKER_READY_TIMEOUT)
+
+        self.watchdog = threading.Thread(
+            target=self.watch_workers, name=f"{self.telegram_bot}:watchdog", daemon=True)
+        self.watchdog.start()
+
+    def spawn_worker(self, index: int):
+        worker = mp_context.Process(
+            target=run_worker,
+            name=f"{self.telegram_bot}:worker:{index}",
+            kwargs=dict(
+                site=self.site, telegram_bot=self.telegram_bot, worker_index=index,
+                queue=self.queues[index], reports=self.reports, queue_size=self.queue_size,
+                **self.worker_options),
+            daemon=True)
+        worker.start()
+        return worker
+
+    def ensure_worker(self, index: int):
+        """
+        Respawns the worker if it died. The new worker picks up from the same queue
+        """
+        if self.workers[index].is_alive():
+            return
+
+        with self.lock:
+            worker = self.workers[index]
+            if worker.is_alive() or self.stop_event.is_set():
+                return
+
+            logger.error(
+                "Worker %s of %s died with exit code %s; respawning",
+                index, self.telegram_bot, worker.exitcode)
+            self.worker_restarts += 1
+            self.workers[index] = self.spawn_worker(index)
+
+    def watch_workers(self):
+        while not self.stop_event.wait(WORKER_CHECK_INTERVAL):
+            for i in range(self.processes):
+                self.ensure_worker(i)
+
+    def submit(self, update: Update):
+        shard = get_shard(update, self.processes)
+        self.ensure_worker(shard)
+        self.queues[shard].put(update.to_json())
+
+    def stop(self):
+        """
+        Asks every worker to finish the Updates queued to it and waits for them to exit
+        """
+        self.stop_event.set()
+        if self.watchdog:
+            self.watchdog.join()
+
+        for queue in self.queues:
+            queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.queues = []
+        self.workers = []
+
+    def get_stats(self) -> dict:
+        return dict(
+            processes=self.processes,
+            queue_size=self.queue_size,
+            workers_alive=sum(1 for worker in self.workers if worker.is_alive()),
+            worker_restarts=self.worker_restarts)
+
+
+class ProcessPoolDispatcher(Dispatcher):
+    """
+    Ingress Dispatcher: doesn't run any handler itself, but routes each Update to a worker process
+    """
+
+    pool: UpdateProcessPool
+
+    @classmethod
+    def make(cls, pool, updater):
+        dispatcher = updater.dispatcher
+        return cls(
+            pool,
+            updater.bot,
+            updater.update_queue,
+            job_queue=updater.job_queue,
+            workers=0,
+            # Class attributes that starts with __ is Mangled
+            exception_event=updater._Updater__exception_event,
+            use_context=dispatcher.use_context,
+        )
+
+    def __init__(self, pool, *args, **kwargs):
+        self.pool = pool
+        super().__init__(*args, **kwargs)
+
+    def start_pool(self) -> None:
+        """
+        Starts the worker processes ahead of receiving Updates. Unless set on the Telegram Bot,
+        the types of Update to receive are the ones the handlers of the workers can match
+        """
+        self.pool.start()
+        if self.allowed_updates is None:
+            self.allowed_updates = self.pool.allowed_updates
+
+    def start(self, ready=None) -> None:
+        self.start_pool()
+        stats_reporter = StatsReporter(
+            site=self.pool.site, telegram_bot=self.pool.telegram_bot, collect=self.get_stats)
+        stats_reporter.start()
+        try:
+            super().start(ready=ready)
+        finally:
+            self.pool.stop()
+            stats_reporter.stop()
+
+    def get_stats(self) -> dict:
+        return dict(update_queue_depth=self.update_queue.qsize(), pool=self.pool.get_stats())
+
+    def process_update(self, update: object) -> None:
+        if isinstance(update, TelegramError):
+            logger.error("Error while receiving updates: %s", update)
+            return
+
+        if isinstance(update, bytes):
+            # Raw Update from the webhook ingress
+            update = parse_update(update, self.bot)
+            if not update:
+                return
+
+        self.pool.submit(update)
+
+
+def run_worker(site, telegram_bot, worker_index, queue, reports=None, queue_size=0,
+               persistent_connections=False, update_workers=0, buffered_logging=False):
+    """
+    Entrypoint of each worker process
+    Feeds the Updates received from the ingress into a regular FrappeTelegramDispatcher
+    """
+    from frappe_telegram.bot import get_bot
+
+    # Shutdown is coordinated by the ingress process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    updater = get_bot(
+        telegram_bot=telegram_bot, site=site, persistent_connections=persistent_connections,
+        update_workers=update_workers, buffered_logging=buffered_logging,
+        update_queue_size=queue_size)
+    dispatcher = updater.dispatcher
+    dispatcher.stats_key = f"{telegram_bot}:worker-{worker_index}"
+    if reports is not None:
+        reports.put(dispatcher.allowed_updates)
+
+    ready = threading.Event()
+    dispatcher_thread = threading.Thread(
+        target=dispatcher.start, kwargs=dict(ready=ready), name="dispatcher")
+    dispatcher_thread.start()
+    ready.wait()
+
+    while True:
+        data = queue.get()
+        if data is None:
+            break
+
+        updater.update_queue.put(Update.de_json(json.loads(data), updater.bot))
+
+    # Dispatcher stops only once its update_queue is drained
+    dispatcher.stop()
+    dispatcher_thread.join()
@@ -0,0 +1,136 @@
+import time
+import logging
+import threading
+
+"""
+Rate limiting for sending messages in bulk.
+Telegram allows about 30 messages per second overall per bot, and about 1 message per second
+to the same chat. Going past either gets a 429 (RetryAfter) back, asking to hold off all sends.
+The overall rate applies to the bot, however many processes send with it. SharedRateLimiter
+hands out the send slots of a bot from redis, so that concurrent jobs share the rate between them.
+"""
+
+# Messages per second, across all chats
+GLOBAL_RATE = 30
+
+# Messages per second, to the same chat
+PER_CHAT_RATE = 1
+
+# Reserves the next send slot of a bot. Slots are spaced ARGV[2] seconds apart, and none is given
+# out before ARGV[3] seconds from now (ARGV[1]). Returns the seconds to wait for the slot
+RESERVE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local slot = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now + tonumber(ARGV[3]))
+local next_slot = slot + tonumber(ARGV[2])
+redis.call('SET', KEYS[1], tostring(next_slot), 'EX', math.ceil(next_slot - now) + 60)
+return tostring(slot - now)
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket():
+    """
+    Holds up to `capacity` tokens, refilled at `rate` tokens per second.
+    Not thread-safe on its own; `RateLimiter` guards its buckets
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_on = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_on) * self.rate)
+        self.updated_on = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Seconds until a token is available
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class RateLimiter():
+    """
+    Combines a global token bucket with a token bucket per chat.
+    `acquire(chat_id)` blocks until a message can be sent to the chat without exceeding either.
+    `pause(seconds)` holds off all sends, for eg: on a RetryAfter
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE):
+        self.per_chat_rate = per_chat_rate
+        self.bucket = TokenBucket(global_rate)
+        self.chat_buckets = dict()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, chat_id=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                chat_bucket = self.get_chat_bucket(chat_id) if chat_id is not None else None
+                wait = max(
+                    self.paused_until - now,
+                    self.bucket.wait_time(now),
+                    chat_bucket.wait_time(now) if chat_bucket else 0)
+
+                if wait <= 0:
+                    self.bucket.consume()
+                    if chat_bucket:
+                        chat_bucket.consume()
+                    return
+
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def get_chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if not bucket:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter whose overall rate & pauses are shared, through redis, by every limiter made
+    with the same key. Per chat rates stay local; recipients aren't shared between jobs
+    """
+
+    def __init__(self, redis, key: str, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE):
+        super().__init__(global_rate=global_rate, per_chat_rate=per_chat_rate)
+        self.redis = redis
+        self.key = key
+
+    def acquire(self, chat_id=None):
+        super().acquire(chat_id)
+        wait = self.reserve(1 / self.bucket.rate)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        super().pause(seconds)
+        self.reserve(0, delay=seconds)
+
+    def reserve(self, interval: float, delay: float = 0) -> float:
+        """
+        Returns the seconds to wait for the next send slot. Falls back to the local rate if
+        redis can't be reached
+        """
+        try:
+            return float(self.redis.eval(
+                RESERVE_SLOT_SCRIPT, 1, self.key, time.time(), interval, delay))
+        except Exception:
+            logger.exception("Failed reserving a send slot on %s", self.key)
+            return 0
@@ -0,0 +1,227 @@
+import re
+from typing import Optional
+
+from telegram import Update, MessageEntity
+from telegram.ext import (
+    Handler, MessageHandler, CommandHandler, PrefixHandler, CallbackQueryHandler,
+    InlineQueryHandler, ChosenInlineResultHandler, ShippingQueryHandler, PreCheckoutQueryHandler,
+    PollHandler, PollAnswerHandler, ChatMemberHandler, ConversationHandler, StringCommandHandler,
+    StringRegexHandler)
+
+"""
+Routing of Updates to the handlers that can match them.
+Dispatcher.process_update calls check_update on the handlers of every group, one after another,
+until one of each group matches. HandlerIndex compiles the handler groups into a route per update
+type, keeping only the handlers able to match that type of Update, in the same groups & order:
+- Messages starting with a command only get the CommandHandlers of that command
+- Callback queries only get the CallbackQueryHandlers whose pattern's literal prefix the
+  callback data starts with
+Handlers the index knows nothing about (TypeHandler, custom handlers) stay on every route.
+"""
+
+MESSAGE_TYPES = frozenset(("message", "edited_message", "channel_post", "edited_channel_post"))
+
+COMMAND_TYPES = frozenset(("message", "edited_message"))
+
+# Fields of an Update, of which one is set
+UPDATE_TYPES = (
+    "message", "edited_message", "inline_query", "chosen_inline_result", "callback_query",
+    "shipping_query", "pre_checkout_query", "poll", "poll_answer", "channel_post",
+    "edited_channel_post", "my_chat_member", "chat_member")
+
+# Checked in order; subclasses first
+HANDLER_UPDATE_TYPES = (
+    (PrefixHandler, COMMAND_TYPES),
+    (CommandHandler, COMMAND_TYPES),
+    (MessageHandler, MESSAGE_TYPES),
+    (CallbackQueryHandler, frozenset(("callback_query",))),
+    (InlineQueryHandler, frozenset(("inline_query",))),
+    (ChosenInlineResultHandler, frozenset(("chosen_inline_result",))),
+    (ShippingQueryHandler, frozenset(("shipping_query",))),
+    (PreCheckoutQueryHandler, frozenset(("pre_checkout_query",))),
+    (PollHandler, frozenset(("poll",))),
+    (PollAnswerHandler, frozenset(("poll_answer",))),
+    (ChatMemberHandler, frozenset(("my_chat_member", "chat_member"))),
+    # Handle str updates only
+    (StringCommandHandler, frozenset()),
+    (StringRegexHandler, frozenset()),
+)
+
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]\\|()")
+
+
+class HandlerIndex():
+
+    def __init__(self, groups: list, handlers: dict):
+        entries = [
+            (group, [
+                (handler, get_handler_update_types(handler), get_handler_commands(handler),
+                 get_callback_data_prefix(handler))
+                for handler in handlers[group]])
+            for group in groups
+        ]
+
+        # Updates that aren't of any known type, or not an Update at all, walk every handler
+        self.default_route = [(group, [(h[0], "") for h in group_entries])
+                              for group, group_entries in entries]
+        self.routes = {
+            update_type: self.compile_route(entries, update_type)
+            for update_type in UPDATE_TYPES
+        }
+
+        commands = set()
+        for group, group_entries in entries:
+            for entry in group_entries:
+                commands.update(entry[2] or ())
+        for command in commands:
+            for update_type in COMMAND_TYPES:
+                self.routes[(update_type, command)] = self.compile_route(
+                    entries, update_type, command)
+
+    @staticmethod
+    def compile_route(entries: list, update_type: str, command: str = None) -> list:
+        """
+        Returns the groups of (handler, callback data prefix) that can match the type of Update
+        """
+        route = []
+        for group, group_entries in entries:
+            group_handlers = [
+                (handler, callback_data_prefix if update_type == "callback_query" else "")
+                for handler, update_types, commands, callback_data_prefix in group_entries
+                if (update_types is None or update_type in update_types)
+                and (commands is None or command in commands)
+            ]
+            if group_handlers:
+                route.append((group, group_handlers))
+
+        return route
+
+    def route(self, update: object) -> list:
+        """
+        Returns the groups of handlers to check the Update against, in order
+        """
+        update_type = get_update_type(update)
+        if not update_type:
+            return self.default_route
+
+        if update_type in COMMAND_TYPES:
+            command = get_command(update)
+            if command and (update_type, command) in self.routes:
+                return self.routes[(update_type, command)]
+
+        route = self.routes[update_type]
+        if update_type != "callback_query":
+            return route
+
+        data = update.callback_query.data
+        data = data if isinstance(data, str) else None
+        return [
+            (group, [
+                (handler, prefix) for handler, prefix in group_handlers
+                if not prefix or (data is not None and data.startswith(prefix))])
+            for group, group_handlers in route
+        ]
+
+
+def get_update_type(update: object) -> Optional[str]:
+    if not isinstance(update, Update):
+        return None
+
+    for update_type in UPDATE_TYPES:
+        if getattr(update, update_type, None):
+            return update_type
+
+    return None
+
+
+def get_command(update: Update) -> Optional[str]:
+    """
+    Returns the command the message starts with, the same way CommandHandler reads it
+    """
+    message = update.effective_message
+    if not (message and message.entities and message.text):
+        return None
+
+    entity = message.entities[0]
+    if entity.type != MessageEntity.BOT_COMMAND or entity.offset != 0:
+        return None
+
+    return message.text[1:entity.length].split("@")[0].lower()
+
+
+def get_handler_update_types(handler: Handler) -> Optional[frozenset]:
+    """
+    Returns the types of Update the handler can match, or None if it could match any
+    """
+    if isinstance(handler, ConversationHandler):
+        conversation_handlers = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            conversation_handlers.extend(state_handlers)
+
+        update_types = set()
+        for conversation_handler in conversation_handlers:
+            handler_update_types = get_handler_update_types(conversation_handler)
+            if handler_update_types is None:
+                return None
+            update_types.update(handler_update_types)
+
+        return frozenset(update_types)
+
+    for handler_class, update_types in HANDLER_UPDATE_TYPES:
+        if isinstance(handler, handler_class):
+            return update_types
+
+    return None
+
+
+def get_handler_commands(handler: Handler) -> Optional[frozenset]:
+    """
+    Returns the commands a CommandHandler is limited to; None for all other handlers
+    """
+    if isinstance(handler, CommandHandler) and not isinstance(handler, PrefixHandler):
+        return frozenset(handler.command)
+
+    return None
+
+
+def get_callback_data_prefix(handler: Handler) -> str:
+    """
+    Returns the literal prefix the callback data has to start with to match the handler's pattern
+    """
+    pattern = getattr(handler, "pattern", None)
+    if not isinstance(handler, CallbackQueryHandler) or not isinstance(pattern, re.Pattern):
+        return ""
+
+    if pattern.flags & re.IGNORECASE or "|" in pattern.pattern:
+        return ""
+
+    source = pattern.pattern
+    if source.startswith("^"):
+        source = source[1:]
+
+    prefix = ""
+    for char in source:
+        if char in REGEX_SPECIAL_CHARS:
+            break
+        prefix += char
+
+    # The last literal is optional or repeated
+    if prefix and source[len(prefix):len(prefix) + 1] in ("?", "*", "{"):
+        prefix = prefix[:-1]
+
+    return prefix
+
+
+def get_handled_update_types(handlers: dict) -> Optional[list]:
+    """
+    Returns the types of Update the handlers can match, or None if they could match any
+    """
+    update_types = set()
+    for group_handlers in handlers.values():
+        for handler in group_handlers:
+            handler_update_types = get_handler_update_types(handler)
+            if handler_update_types is None:
+                return None
+            update_types.update(handler_update_types)
+
+    return [update_type for update_type in UPDATE_TYPES if update_type in update_types]
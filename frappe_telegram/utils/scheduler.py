@@ -0,0 +1,152 @@
+import time
+import logging
+import threading
+from queue import Queue
+from typing import Callable
+
+"""
+Per-chat ordered, cross-chat parallel scheduling of Updates.
+Updates are sharded by their chat id onto a fixed pool of worker threads. Each shard is
+served by exactly one thread, which keeps the Updates of a chat strictly in order while
+Updates of independent chats are processed in parallel.
+With max_pending, submit blocks while that many Updates are queued or being processed, so that
+the backlog builds up in front of the scheduler (where it is bounded) rather than on the shards.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard_key(update: object):
+    """
+    Returns the key Updates are sharded by: the chat id, falling back to the user id
+    for chat-less Updates (inline queries etc). Returns None for anything else
+    """
+    for attr in ("effective_chat", "effective_user"):
+        obj = getattr(update, attr, None)
+        if obj:
+            return obj.id
+
+    return None
+
+
+def get_shard(update: object, shards: int) -> int:
+    key = get_shard_key(update)
+    if key is None:
+        return 0
+
+    return hash(key) % shards
+
+
+class ChatShardScheduler():
+    """
+    Distributes Updates onto `workers` threads, sharded by chat
+
+    :param process_update: Called with each Update, from within the worker thread of its shard.
+        Can be overridden per Update on submit, for a pool shared by many dispatchers
+    :param workers: Size of the worker pool
+    :param on_worker_exit: Optionally called from within each worker thread before it exits
+    :param max_pending: Updates submitted but not yet processed, at most. Unbounded if 0
+    """
+
+    def __init__(self, process_update: Callable[[object], None], workers: int,
+                 on_worker_exit: Callable[[], None] = None, name: str = "telegram",
+                 max_pending: int = 0):
+        self.process_update = process_update
+        self.workers = workers
+        self.on_worker_exit = on_worker_exit
+        self.name = name
+        self.max_pending = max_pending
+        # Taken on submit, given back once the Update is processed
+        self.admission = threading.BoundedSemaphore(max_pending) if max_pending else None
+
+        self.queues = [Queue() for _ in range(workers)]
+        self.threads = []
+        self.shard_stats = [
+            dict(processed=0, errors=0, wait_time=0.0, process_time=0.0, max_process_time=0.0)
+            for _ in range(workers)
+        ]
+
+    def start(self):
+        for shard in range(self.workers):
+            thread = threading.Thread(
+                target=self.work, args=(shard,), name=f"{self.name}:shard:{shard}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, update: object, process_update: Callable[[object], None] = None):
+        """
+        Blocks while max_pending Updates are pending
+        """
+        if self.admission:
+            self.admission.acquire()
+        self.queues[get_shard(update, self.workers)].put(
+            (time.monotonic(), update, process_update or self.process_update))
+
+    def work(self, shard: int):
+        queue = self.queues[shard]
+        stats = self.shard_stats[shard]
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    queue.task_done()
+                    break
+
+                queued_on, update, process_update = item
+                started_on = time.monotonic()
+                try:
+                    process_update(update)
+                except Exception:
+                    stats["errors"] += 1
+                    logger.exception("Error processing update on shard %s", shard)
+                finally:
+                    process_time = time.monotonic() - started_on
+                    stats["processed"] += 1
+                    stats["wait_time"] += started_on - queued_on
+                    stats["process_time"] += process_time
+                    stats["max_process_time"] = max(stats["max_process_time"], process_time)
+                    if self.admission:
+                        self.admission.release()
+                    queue.task_done()
+        finally:
+            if self.on_worker_exit:
+                self.on_worker_exit()
+
+    def join(self):
+        """
+        Blocks until every submitted Update is processed
+        """
+        for queue in self.queues:
+            queue.join()
+
+    def stop(self):
+        """
+        Processes the Updates already submitted and stops the worker threads
+        """
+        for queue in self.queues:
+            queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def get_stats(self) -> dict:
+        shards = []
+        for shard, stats in enumerate(self.shard_stats):
+            processed = stats["processed"] or 1
+            shards.append(dict(
+                stats,
+                shard=shard,
+                queue_depth=self.queues[shard].qsize(),
+                avg_wait_time=stats["wait_time"] / processed,
+                avg_process_time=stats["process_time"] / processed,
+            ))
+
+        return dict(
+            workers=self.workers, queue_depth=self.queue_depth, max_pending=self.max_pending,
+            shards=shards)
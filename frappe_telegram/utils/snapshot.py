@@ -0,0 +1,45 @@
+"""
+Read-only snapshots of the documents resolved on every Update (Telegram User, Telegram Chat) are
+cached in-process; see `get_telegram_user_by_id` & `get_telegram_chat_by_id`.
+Handlers get them on the context as LazyDocuments, which behave like the Document itself, but only
+load it from the db when something beyond the snapshot is needed.
+"""
+
+
+class LazyDocument():
+    """
+    Stands in for the Document of a snapshot. The fields of the snapshot are read from it, until
+    the Document is loaded by any other use: other fields, methods (save, db_set, append...) or
+    assignments. It is loaded once, on the first of them
+    """
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, "_snapshot", snapshot)
+        object.__setattr__(self, "_doc", None)
+
+    def get_document(self):
+        """
+        Returns the Document, loading it if not done yet
+        """
+        doc = self._doc
+        if doc is None:
+            doc = self._snapshot.get_doc()
+            object.__setattr__(self, "_doc", doc)
+
+        return doc
+
+    def __getattr__(self, name):
+        # Only called for what isn't an attribute of the LazyDocument itself
+        if self._doc is None and name in self._snapshot._fields:
+            return getattr(self._snapshot, name)
+
+        return getattr(self.get_document(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_document(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self.get_document(), name)
+
+    def __repr__(self):
+        return "<LazyDocument of {!r}>".format(self._doc or self._snapshot)
@@ -0,0 +1,72 @@
+import logging
+import threading
+from typing import Callable
+
+import frappe
+from frappe.utils import now
+
+"""
+Runtime counters of a running bot (queue depths, latencies etc) are published to redis-cache
+periodically, so that they can be inspected from outside the bot process.
+See `bench telegram bot-stats`
+"""
+
+STATS_CACHE_KEY = "telegram_bot_stats"
+
+# Seconds between two reports
+STATS_REPORT_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+
+def publish_bot_stats(telegram_bot: str, stats: dict):
+    frappe.cache().hset(STATS_CACHE_KEY, telegram_bot, stats)
+
+
+def get_bot_stats(telegram_bot: str) -> dict:
+    """
+    Returns the stats reported by the bot, along with its worker processes' if any
+    """
+    stats = {}
+    for key, value in (frappe.cache().hgetall(STATS_CACHE_KEY) or {}).items():
+        key = frappe.safe_decode(key)
+        if key == telegram_bot or key.startswith(telegram_bot + ":"):
+            stats[key] = value
+
+    return stats
+
+
+class StatsReporter(threading.Thread):
+    """
+    Publishes the dict returned by `collect` every `interval` seconds until stopped
+    """
+
+    def __init__(self, site: str, telegram_bot: str, collect: Callable[[], dict],
+                 interval: float = STATS_REPORT_INTERVAL):
+        super().__init__(name=f"{telegram_bot}:stats", daemon=True)
+        self.site = site
+        self.telegram_bot = telegram_bot
+        self.collect = collect
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        # Redis access needs the site config only; no db connection is made
+        frappe.init(site=self.site)
+        try:
+            while not self.stop_event.wait(self.interval):
+                self.report()
+            self.report()
+        finally:
+            frappe.destroy()
+
+    def report(self):
+        try:
+            publish_bot_stats(
+                self.telegram_bot, dict(self.collect(), reported_on=now()))
+        except Exception:
+            logger.exception("Failed publishing stats of %s", self.telegram_bot)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
@@ -3,6 +3,7 @@ import configparser
 
 import frappe
 from .bench import get_bench_path, get_bench_name, get_site_path
+from .polling import DRAIN_TIMEOUT
 
 """
 supervisor.conf follows configparser format (Win-INI style)
@@ -12,7 +13,9 @@ We will have a new process group for all the telegram-bots
 
 def add_supervisor_entry(
         telegram_bot, polling=False, poll_interval=0,
-        webhook=False, webhook_port=0, webhook_url=None):
+        webhook=False, webhook_port=0, webhook_url=None, persistent_connections=False,
+        update_workers=0, processes=0, buffered_logging=False, webhook_queue_size=0,
+        webhook_overflow=None, drain_timeout=0):
 
     # Validate telegram_bot exists
     if not frappe.db.exists("Telegram Bot", telegram_bot):
@@ -23,7 +26,11 @@ def add_supervisor_entry(
     # Program
     program_name, program = get_bot_program(
         config=config, telegram_bot=telegram_bot, polling=polling, poll_interval=poll_interval,
-        webhook=webhook, webhook_port=webhook_port, webhook_url=webhook_url)
+        webhook=webhook, webhook_port=webhook_port, webhook_url=webhook_url,
+        persistent_connections=persistent_connections, update_workers=update_workers,
+        processes=processes, buffered_logging=buffered_logging,
+        webhook_queue_size=webhook_queue_size, webhook_overflow=webhook_overflow,
+        drain_timeout=drain_timeout)
 
     config[program_name] = program
 
@@ -88,6 +95,8 @@ def get_bot_program(config, telegram_bot, **kwargs):
         "autorestart": "true",
         "stdout_logfile": logs[0],
         "stderr_logfile": logs[1],
+        # Leave the bot time to drain before it is killed
+        "stopwaitsecs": int((kwargs.get("drain_timeout") or DRAIN_TIMEOUT) + 10),
         "user": guess_user_from_web_program(config=config),
         "directory": os.path.abspath(get_site_path(".."))
     }
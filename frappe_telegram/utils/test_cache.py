@@ -0,0 +1,37 @@
+import time
+import unittest
+
+from frappe_telegram.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Touch "a", so that "b" is the least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=0.05)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_pop(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.pop("a"))
+        self.assertNotIn("a", cache)
@@ -0,0 +1,66 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+import frappe
+from frappe_telegram.utils.dedup import UpdateDeduplicator
+
+
+class TestUpdateDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.telegram_bot = "test-dedup-" + frappe.generate_hash(length=6)
+
+    def tearDown(self):
+        frappe.cache().delete_keys(f"telegram_update_id|{self.telegram_bot}|")
+
+    def test_drops_repeated_updates(self):
+        deduplicator = UpdateDeduplicator(self.telegram_bot)
+        update = SimpleNamespace(update_id=1)
+
+        self.assertFalse(deduplicator.is_duplicate(update))
+        self.assertTrue(deduplicator.is_duplicate(update))
+        self.assertFalse(deduplicator.is_duplicate(SimpleNamespace(update_id=2)))
+        self.assertEqual(deduplicator.duplicates, 1)
+
+    def test_drops_updates_claimed_by_another_process(self):
+        UpdateDeduplicator(self.telegram_bot).is_duplicate(SimpleNamespace(update_id=1))
+
+        deduplicator = UpdateDeduplicator(self.telegram_bot)
+        self.assertTrue(deduplicator.is_duplicate(SimpleNamespace(update_id=1)))
+        # Not an Update
+        self.assertFalse(deduplicator.is_duplicate(Exception()))
+
+    def test_drops_updates_done_by_another_process(self):
+        update = SimpleNamespace(update_id=1)
+        other = UpdateDeduplicator(self.telegram_bot)
+        other.is_duplicate(update)
+        other.done(update)
+
+        deduplicator = UpdateDeduplicator(self.telegram_bot)
+        self.assertTrue(deduplicator.is_duplicate(update))
+        # Done, even for the only process polling the bot
+        self.assertTrue(deduplicator.is_duplicate(update, exclusive=False))
+
+    def test_processes_updates_released_by_another_process(self):
+        update = SimpleNamespace(update_id=1)
+        other = UpdateDeduplicator(self.telegram_bot)
+        other.is_duplicate(update)
+        other.release(update)
+
+        self.assertFalse(UpdateDeduplicator(self.telegram_bot).is_duplicate(update))
+
+    def test_processes_updates_never_done(self):
+        "An Update claimed by a process that died is processed once received again"
+        update = SimpleNamespace(update_id=1)
+        UpdateDeduplicator(self.telegram_bot, processing_ttl=1).is_duplicate(update)
+
+        deduplicator = UpdateDeduplicator(self.telegram_bot, processing_ttl=1)
+        self.assertTrue(deduplicator.is_duplicate(update))
+        time.sleep(1.5)
+        self.assertFalse(deduplicator.is_duplicate(update))
+
+        # Polled Updates don't wait for the claim to expire
+        update = SimpleNamespace(update_id=2)
+        UpdateDeduplicator(self.telegram_bot).is_duplicate(update)
+        self.assertFalse(deduplicator.is_duplicate(update, exclusive=False))
@@ -0,0 +1,35 @@
+import unittest
+from types import SimpleNamespace
+
+from frappe_telegram.utils.polling import UpdateTracker
+
+
+def make_updates(*update_ids):
+    return [SimpleNamespace(update_id=update_id) for update_id in update_ids]
+
+
+class TestUpdateTracker(unittest.TestCase):
+
+    def test_offset_stays_at_oldest_unprocessed_update(self):
+        tracker = UpdateTracker(offset=10)
+        updates = tracker.track(make_updates(10, 11, 12))
+        self.assertEqual(tracker.get_offset(), 10)
+
+        tracker.done(updates[1])
+        self.assertEqual(tracker.get_offset(), 10)
+        tracker.done(updates[0])
+        self.assertEqual(tracker.get_offset(), 12)
+
+        # Sent again by Telegram while still in flight
+        self.assertEqual([u.update_id for u in tracker.track(make_updates(12, 13))], [13])
+
+        tracker.done(updates[2])
+        tracker.done(SimpleNamespace(update_id=13))
+        self.assertEqual(tracker.get_offset(), 14)
+        self.assertTrue(tracker.wait_until_drained(0))
+
+    def test_drain_timeout(self):
+        tracker = UpdateTracker()
+        tracker.track(make_updates(1))
+        self.assertFalse(tracker.wait_until_drained(0.01))
+        self.assertEqual(tracker.in_flight, 1)
@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from frappe_telegram.utils.rate_limit import RateLimiter, SharedRateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_global_rate(self):
+        limiter = RateLimiter(global_rate=50, per_chat_rate=50)
+
+        started_on = time.monotonic()
+        for chat_id in range(11):
+            limiter.acquire(chat_id)
+
+        # First token is available right away, the next 10 at 50/s
+        self.assertGreaterEqual(time.monotonic() - started_on, 0.19)
+
+    def test_per_chat_rate(self):
+        limiter = RateLimiter(global_rate=1000, per_chat_rate=10)
+
+        started_on = time.monotonic()
+        limiter.acquire("a")
+        limiter.acquire("b")
+        self.assertLess(time.monotonic() - started_on, 0.05)
+
+        limiter.acquire("a")
+        self.assertGreaterEqual(time.monotonic() - started_on, 0.09)
+
+    def test_pause(self):
+        limiter = RateLimiter(global_rate=1000)
+        limiter.pause(0.1)
+
+        started_on = time.monotonic()
+        limiter.acquire("a")
+        self.assertGreaterEqual(time.monotonic() - started_on, 0.09)
+
+    def test_shared_limiter_without_redis(self):
+        """
+        Sends go on at the local rate when redis can't be reached
+        """
+        class UnreachableRedis():
+            def eval(self, *args):
+                raise ConnectionError
+
+        limiter = SharedRateLimiter(UnreachableRedis(), "bot", global_rate=50, per_chat_rate=50)
+        started_on = time.monotonic()
+        for chat_id in range(11):
+            limiter.acquire(chat_id)
+
+        self.assertGreaterEqual(time.monotonic() - started_on, 0.19)
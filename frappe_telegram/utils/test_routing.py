@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime
+
+from telegram import Update, Message, Chat, CallbackQuery, User, MessageEntity, Bot
+from telegram.ext import (
+    MessageHandler, CommandHandler, CallbackQueryHandler, TypeHandler, Filters)
+
+from frappe_telegram.utils.routing import (
+    HandlerIndex, get_callback_data_prefix, get_handled_update_types)
+
+
+def noop(update, context):
+    pass
+
+
+class TestHandlerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = Bot("123:abc")
+        self.user = User(1, "Test", False)
+        self.chat = Chat(1, "private")
+
+    def make_message(self, text):
+        entities = []
+        if text.startswith("/"):
+            entities.append(MessageEntity(
+                MessageEntity.BOT_COMMAND, 0, len(text.split()[0])))
+        return Update(1, message=Message(
+            1, datetime.now(), self.chat, from_user=self.user, text=text, entities=entities,
+            bot=self.bot))
+
+    def make_callback_query(self, data):
+        return Update(1, callback_query=CallbackQuery(
+            "1", self.user, "instance", data=data, bot=self.bot))
+
+    def get_routed_handlers(self, index, update):
+        return [handler for _, handlers in index.route(update) for handler, _ in handlers]
+
+    def test_routes_by_update_type_command_and_callback_data(self):
+        pre_processor = MessageHandler(None, noop)
+        start = CommandHandler("start", noop)
+        help_ = CommandHandler("help", noop)
+        text = MessageHandler(Filters.text, noop)
+        approve = CallbackQueryHandler(noop, pattern="^approve:")
+        reject = CallbackQueryHandler(noop, pattern="reject:(.*)")
+        any_callback = CallbackQueryHandler(noop)
+
+        index = HandlerIndex([-1000, 0, 1], {
+            -1000: [pre_processor],
+            0: [start, help_, approve, reject, any_callback],
+            1: [text],
+        })
+
+        self.assertEqual(
+            self.get_routed_handlers(index, self.make_message("/start now")),
+            [pre_processor, start, text])
+        self.assertEqual(
+            self.get_routed_handlers(index, self.make_message("hello")), [pre_processor, text])
+        self.assertEqual(
+            self.get_routed_handlers(index, self.make_callback_query("reject:12")),
+            [reject, any_callback])
+        self.assertEqual(
+            self.get_routed_handlers(index, self.make_callback_query(None)), [any_callback])
+
+        # Not an Update; walks every handler
+        self.assertEqual(len(self.get_routed_handlers(index, "update")), 7)
+
+    def test_callback_data_prefix(self):
+        def prefix(pattern):
+            return get_callback_data_prefix(CallbackQueryHandler(noop, pattern=pattern))
+
+        self.assertEqual(prefix("^approve:(\\d+)$"), "approve:")
+        self.assertEqual(prefix("items?"), "item")
+        self.assertEqual(prefix("yes|no"), "")
+        self.assertEqual(prefix(".*"), "")
+
+    def test_handled_update_types(self):
+        handlers = {
+            -100: [MessageHandler(None, noop)],
+            0: [CommandHandler("start", noop), CallbackQueryHandler(noop)],
+        }
+        self.assertEqual(get_handled_update_types(handlers), [
+            "message", "edited_message", "callback_query", "channel_post", "edited_channel_post"])
+
+        handlers[1] = [TypeHandler(Update, noop)]
+        self.assertIsNone(get_handled_update_types(handlers))
@@ -0,0 +1,65 @@
+import time
+import threading
+import unittest
+from types import SimpleNamespace
+
+from frappe_telegram.utils.scheduler import ChatShardScheduler, get_shard
+
+
+class TestChatShardScheduler(unittest.TestCase):
+
+    def make_update(self, chat_id, seq):
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), seq=seq)
+
+    def test_per_chat_ordering(self):
+        """
+        Updates of the same chat are processed in the order they were submitted
+        """
+        processed = []
+        lock = threading.Lock()
+
+        def process_update(update):
+            time.sleep(0.001)
+            with lock:
+                processed.append((update.effective_chat.id, update.seq))
+
+        scheduler = ChatShardScheduler(process_update, workers=4)
+        scheduler.start()
+        for seq in range(25):
+            for chat_id in (1, 2, -1003, 4, 5):
+                scheduler.submit(self.make_update(chat_id, seq))
+        scheduler.stop()
+
+        self.assertEqual(len(processed), 125)
+        for chat_id in (1, 2, -1003, 4, 5):
+            self.assertEqual([x[1] for x in processed if x[0] == chat_id], list(range(25)))
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(sum(x["processed"] for x in stats["shards"]), 125)
+
+    def test_slow_chat_does_not_block_others(self):
+        """
+        A slow handler in one chat doesn't stall the chats on other shards
+        """
+        release = threading.Event()
+        done = threading.Event()
+        slow_chat, fast_chat = 0, 1
+        self.assertNotEqual(
+            get_shard(self.make_update(slow_chat, 0), 2),
+            get_shard(self.make_update(fast_chat, 0), 2))
+
+        def process_update(update):
+            if update.effective_chat.id == slow_chat:
+                release.wait(5)
+            else:
+                done.set()
+
+        scheduler = ChatShardScheduler(process_update, workers=2)
+        scheduler.start()
+        scheduler.submit(self.make_update(slow_chat, 0))
+        scheduler.submit(self.make_update(fast_chat, 0))
+
+        self.assertTrue(done.wait(2))
+        release.set()
+        scheduler.stop()
@@ -0,0 +1,36 @@
+import unittest
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from frappe_telegram.utils.snapshot import LazyDocument
+
+
+class Snapshot(NamedTuple):
+    name: str
+    user: str
+
+    def get_doc(self):
+        Snapshot.loads += 1
+        return SimpleNamespace(name=self.name, user=self.user, is_guest=0, saved=False)
+
+
+class TestLazyDocument(unittest.TestCase):
+
+    def setUp(self):
+        Snapshot.loads = 0
+
+    def test_reads_snapshot_fields_without_loading(self):
+        doc = LazyDocument(Snapshot("TU-1", "user@example.com"))
+        self.assertEqual((doc.name, doc.user), ("TU-1", "user@example.com"))
+        self.assertEqual(Snapshot.loads, 0)
+
+    def test_loads_document_once_on_other_uses(self):
+        doc = LazyDocument(Snapshot("TU-1", "user@example.com"))
+        self.assertEqual(doc.is_guest, 0)
+        self.assertEqual(Snapshot.loads, 1)
+
+        doc.user = "other@example.com"
+        doc.saved = True
+        self.assertEqual(doc.user, "other@example.com")
+        self.assertTrue(doc.get_document().saved)
+        self.assertEqual(Snapshot.loads, 1)
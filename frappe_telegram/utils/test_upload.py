@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from frappe_telegram.utils import upload
+from frappe_telegram.utils.upload import get_multipart_body
+
+
+class TestMultipartBody(unittest.TestCase):
+
+    def setUp(self):
+        self.content = os.urandom(upload.UPLOAD_CHUNK_SIZE * 3 + 7)
+        fd, self.file_path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_body(self):
+        content_type, length, body = get_multipart_body(
+            dict(chat_id=1, caption="Invoice", parse_mode=None), "document", self.file_path,
+            filename="invoice.pdf")
+
+        chunks = list(body)
+        data = b"".join(chunks)
+        boundary = content_type.split("boundary=")[1].encode()
+
+        self.assertEqual(len(data), length)
+        self.assertLessEqual(max(len(x) for x in chunks), upload.UPLOAD_CHUNK_SIZE)
+        self.assertIn(self.content, data)
+        self.assertIn(b'name="caption"\r\n\r\nInvoice\r\n', data)
+        self.assertNotIn(b'name="parse_mode"', data)
+        self.assertIn(b'filename="invoice.pdf"\r\nContent-Type: application/pdf', data)
+        self.assertTrue(data.endswith(b"--" + boundary + b"--\r\n"))
+
+    def test_file_closed_on_abort(self):
+        _, _, body = get_multipart_body({}, "document", self.file_path)
+        next(body)
+        next(body)
+
+        f = body.gi_frame.f_locals["f"]
+        self.assertFalse(f.closed)
+        body.close()
+        self.assertTrue(f.closed)
@@ -0,0 +1,75 @@
+import json
+import unittest
+import threading
+from queue import Queue
+from types import SimpleNamespace
+
+from frappe_telegram.utils.scheduler import ChatShardScheduler
+from frappe_telegram.utils.webhook import WebhookIngress
+
+
+class TestWebhookIngress(unittest.TestCase):
+
+    def make_ingress(self, overflow):
+        ingress = WebhookIngress("127.0.0.1", 0, update_queue=Queue(maxsize=2), overflow=overflow)
+        self.addCleanup(ingress.server_close)
+        return ingress
+
+    def test_overflow_policies(self):
+        ingress = self.make_ingress("reject")
+        self.assertTrue(ingress.enqueue(b"1"))
+        self.assertTrue(ingress.enqueue(b"2"))
+        self.assertFalse(ingress.enqueue(b"3"))
+        self.assertEqual(ingress.get_stats()["rejected"], 1)
+
+        ingress = self.make_ingress("drop_newest")
+        for data in (b"1", b"2", b"3"):
+            self.assertTrue(ingress.enqueue(data))
+        self.assertEqual(list(ingress.update_queue.queue), [b"1", b"2"])
+
+        ingress = self.make_ingress("drop_oldest")
+        for data in (b"1", b"2", b"3"):
+            self.assertTrue(ingress.enqueue(data))
+        self.assertEqual(list(ingress.update_queue.queue), [b"2", b"3"])
+        self.assertEqual(ingress.get_stats()["dropped"], 1)
+
+    def test_unknown_overflow_policy(self):
+        self.assertRaises(ValueError, WebhookIngress, "127.0.0.1", 0, Queue(), overflow="spill")
+
+    def test_overflow_with_update_workers(self):
+        """
+        With update_workers > 1, the Updates the workers fall behind on are held back on the
+        bounded update_queue, so that the overflow policy applies
+        """
+        release = threading.Event()
+        ingress = self.make_ingress("reject")
+        scheduler = ChatShardScheduler(
+            lambda update: release.wait(5), workers=4,
+            max_pending=ingress.update_queue.maxsize)
+        scheduler.start()
+
+        def dispatch():
+            while True:
+                data = ingress.update_queue.get()
+                if data is None:
+                    break
+                chat_id = json.loads(data)["chat_id"]
+                scheduler.submit(SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id)))
+
+        dispatcher = threading.Thread(target=dispatch)
+        dispatcher.start()
+
+        accepted = sum(
+            ingress.enqueue(json.dumps(dict(chat_id=chat_id)).encode())
+            for chat_id in range(20))
+        # 2 pending on the scheduler, 1 waiting to be submitted & 2 on the update_queue, at most
+        self.assertLessEqual(accepted, 5)
+        self.assertEqual(ingress.get_stats()["rejected"], 20 - accepted)
+        self.assertLessEqual(scheduler.queue_depth, 2)
+
+        release.set()
+        ingress.update_queue.put(None)
+        dispatcher.join()
+        scheduler.stop()
+        self.assertEqual(
+            sum(x["processed"] for x in scheduler.get_stats()["shards"]), accepted)
@@ -0,0 +1,85 @@
+import os
+import mimetypes
+from uuid import uuid4
+
+from telegram import Bot, Message
+
+"""
+Streaming uploads of files on disk.
+python-telegram-bot reads the whole file into memory before uploading it. Here, the multipart
+body is generated on the fly, reading the file in chunks of UPLOAD_CHUNK_SIZE, so that memory
+stays bounded whatever the file size. The file is closed as soon as the body is consumed, or
+when the upload fails.
+"""
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Seconds to wait for Telegram to respond to an upload
+UPLOAD_TIMEOUT = 60
+
+
+def send_document_streamed(bot: Bot, chat_id, file_path: str, filename: str = None,
+                           caption: str = None, parse_mode: str = None,
+                           timeout: float = UPLOAD_TIMEOUT) -> Message:
+    from telegram.utils.request import Timeout
+
+    fields = dict(chat_id=chat_id, caption=caption, parse_mode=parse_mode)
+    content_type, length, body = get_multipart_body(
+        fields, "document", file_path, filename=filename)
+
+    try:
+        data = bot.request._request_wrapper(
+            "POST", "{}/sendDocument".format(bot.base_url),
+            body=body,
+            headers={"Content-Type": content_type, "Content-Length": str(length)},
+            timeout=Timeout(read=timeout, connect=bot.request._connect_timeout),
+            # A consumed body can't be sent again
+            retries=False,
+        )
+    finally:
+        body.close()
+
+    return Message.de_json(bot.request._parse(data), bot)
+
+
+def get_multipart_body(fields: dict, file_field: str, file_path: str, filename: str = None):
+    """
+    Returns the content type, the length and a generator of a multipart/form-data body
+    """
+    boundary = uuid4().hex
+    filename = filename or os.path.basename(file_path)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    head = b""
+    for name, value in fields.items():
+        if value is None:
+            continue
+        head += (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+            f"{value}\r\n").encode("utf-8")
+
+    head += (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"{file_field}\"; "
+        f"filename=\"{filename.replace(chr(34), '%22')}\"\r\n"
+        f"Content-Type: {mimetype}\r\n\r\n").encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    size = os.path.getsize(file_path)
+    length = len(head) + size + len(tail)
+
+    def body():
+        yield head
+        with open(file_path, "rb") as f:
+            # Never send more than announced in Content-Length, even if the file grows meanwhile
+            remaining = size
+            while remaining > 0:
+                chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        yield tail
+
+    return f"multipart/form-data; boundary={boundary}", length, body()
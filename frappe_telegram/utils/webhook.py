@@ -0,0 +1,166 @@
+import json
+import logging
+import threading
+from queue import Full, Empty
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from telegram import Update
+from telegram.ext import Updater
+
+"""
+Webhook ingress for Telegram Updates.
+A request is answered as soon as its raw body is on the dispatcher's update_queue; parsing the
+Update happens on the dispatcher thread, off the request path. The update_queue is bounded, and
+OVERFLOW_POLICIES decide what happens to Updates arriving while it is full:
+- reject: answer 503, so that Telegram delivers the Update again later. Nothing is lost
+- drop_newest: answer 200 and drop the incoming Update
+- drop_oldest: answer 200, and drop the oldest queued Update to make room
+- block: wait for room before answering
+"""
+
+OVERFLOW_POLICIES = ("reject", "drop_newest", "drop_oldest", "block")
+
+# Updates queued for the dispatcher, at most
+WEBHOOK_QUEUE_SIZE = 10000
+
+# Telegram Updates are a few KB; anything way larger isn't one
+MAX_BODY_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def start_webhook_ingress(updater: Updater, listen: str, port: int, url_path: str = None,
+                          webhook_url: str = None, overflow: str = "reject",
+                          allowed_updates: list = None) -> "WebhookIngress":
+    """
+    Starts the updater's dispatcher and a WebhookIngress feeding it, in place of
+    Updater.start_webhook. The ingress is set as the updater's httpd, so that Updater.stop
+    (and so Updater.idle) stops it before stopping the dispatcher
+    """
+    ingress = WebhookIngress(
+        listen, port, update_queue=updater.update_queue, url_path=url_path, overflow=overflow)
+    if hasattr(updater.dispatcher, "webhook_ingress"):
+        updater.dispatcher.webhook_ingress = ingress
+
+    updater.running = True
+    updater.httpd = ingress
+
+    dispatcher_ready = threading.Event()
+    updater._init_thread(updater.dispatcher.start, "dispatcher", ready=dispatcher_ready)
+    dispatcher_ready.wait()
+    updater._init_thread(ingress.serve_forever, "webhook_ingress")
+
+    if webhook_url:
+        updater.bot.set_webhook(url=webhook_url, allowed_updates=allowed_updates)
+
+    return ingress
+
+
+def parse_update(data, bot) -> Update:
+    """
+    Parses a raw Update received by the ingress. Returns None if it isn't valid
+    """
+    try:
+        return Update.de_json(json.loads(data), bot)
+    except Exception:
+        logger.exception("Received an invalid Update: %s", data[:1000])
+        return None
+
+
+class WebhookIngress(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, listen: str, port: int, update_queue, url_path: str = None,
+                 overflow: str = "reject"):
+        """
+        url_path: Only accept Updates POSTed on this path. Any path, by default, since the
+            nginx location proxying to the ingress passes its own path along
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+
+        super().__init__((listen, port), WebhookRequestHandler)
+        self.update_queue = update_queue
+        self.url_path = "/" + url_path.strip("/") if url_path else None
+        self.overflow = overflow
+        self.stats = dict(received=0, rejected=0, dropped=0)
+        self.stats_lock = threading.Lock()
+
+    def enqueue(self, data: bytes) -> bool:
+        """
+        Returns False if the Update has to be delivered again
+        """
+        try:
+            self.update_queue.put_nowait(data)
+            self.count("received")
+            return True
+        except Full:
+            pass
+
+        if self.overflow == "reject":
+            self.count("rejected")
+            return False
+
+        if self.overflow == "drop_newest":
+            self.count("dropped")
+            return True
+
+        if self.overflow == "block":
+            self.update_queue.put(data)
+            self.count("received")
+            return True
+
+        # drop_oldest
+        while True:
+            try:
+                self.update_queue.get_nowait()
+                self.update_queue.task_done()
+                self.count("dropped")
+            except Empty:
+                pass
+            try:
+                self.update_queue.put_nowait(data)
+                self.count("received")
+                return True
+            except Full:
+                continue
+
+    def count(self, stat: str):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def get_stats(self) -> dict:
+        return dict(
+            self.stats, overflow=self.overflow, queue_depth=self.update_queue.qsize(),
+            max_queue_size=self.update_queue.maxsize)
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive; Telegram reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        url_path = self.server.url_path
+        if url_path and self.path.split("?")[0].rstrip("/") != url_path.rstrip("/"):
+            return self.respond(404)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length or length > MAX_BODY_SIZE:
+            return self.respond(413 if length else 400)
+
+        data = self.rfile.read(length)
+        self.respond(200 if self.server.enqueue(data) else 503)
+
+    def respond(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        if status not in (200, 503):
+            # The body wasn't read, so the connection can't be reused
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)